@@ -5,7 +5,7 @@ from typing import Optional, List
 @dataclass
 class DatasetConfig:
     lmdb_path: str
-    num_workers: int = 0
+    num_workers: Optional[int] = 0  # None => auto: min(os.cpu_count(), 8)
     batch_size: int = 64  # PK-sampling P=8 K=8 => batch=64 (увеличено благодаря уменьшению max_sequence_length)
     augment: bool = True
     max_sequence_length: int = 1024  # Уменьшено с 2048 для экономии памяти и возможности увеличения batch_size
@@ -66,6 +66,9 @@ class TrainingConfig:
     # Logging
     log_frequency: int = 50  # Частота логгирования (каждые N батчей)
     
+    # torch.compile the encoder for training/eval (PyTorch 2+, CUDA only)
+    compile_model: bool = False
+    
     # Legacy fields (auto-computed from output_dir + timestamp, kept for compatibility)
     checkpoint_dir: Optional[str] = None
     log_dir: Optional[str] = None
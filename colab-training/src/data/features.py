@@ -1,15 +1,22 @@
 from __future__ import annotations
 
 from typing import List, Dict, Callable, Any
+import logging
 import math
 import numpy as np
 import torch
 
+logger = logging.getLogger(__name__)
+
+# the non-finite fallback in apply_feature_pipeline is reported once per process
+_warned_non_finite = False
+
 # ---- Dynamic feature registry -------------------------------------------------
 
 # Users can register custom feature-computation callbacks which receive a
 # dictionary with already-computed base/derived channels and must return a
-# 1-D numpy array of shape [T].
+# 1-D numpy array of shape [T]. The derived channels they receive are clipped
+# and NaN/Inf-free (replaced with 0), as before.
 #
 # Example:
 #   @register_feature("log_speed")
@@ -150,6 +157,7 @@ def apply_feature_pipeline(seq: torch.Tensor, pipeline: List[str]) -> torch.Tens
                      "dp","dp_dt","path_len","pause","stroke_id","prate","path_velocity",
                      "path_tangent_angle","abs_delta_pressure".
     """
+    global _warned_non_finite
     if pipeline is None or len(pipeline) == 0:
         return seq
 
@@ -227,19 +235,6 @@ def apply_feature_pipeline(seq: torch.Tensor, pipeline: List[str]) -> torch.Tens
     path_velocity = _clip_extreme_values(path_velocity)
     abs_delta_pressure = _clip_extreme_values(abs_delta_pressure)
     
-    # Additional safety: replace any remaining NaN/Inf with zeros
-    for key in ["vx", "vy"]:
-        v[key] = np.nan_to_num(v[key], nan=0.0, posinf=0.0, neginf=0.0)
-    for key in ["ax", "ay"]:
-        a[key] = np.nan_to_num(a[key], nan=0.0, posinf=0.0, neginf=0.0)
-    for key in ["jx", "jy", "jerk"]:
-        j[key] = np.nan_to_num(j[key], nan=0.0, posinf=0.0, neginf=0.0)
-    
-    prate = np.nan_to_num(prate, nan=0.0, posinf=0.0, neginf=0.0)
-    path_velocity = np.nan_to_num(path_velocity, nan=0.0, posinf=0.0, neginf=0.0)
-    path_tangent_angle = np.nan_to_num(path_tangent_angle, nan=0.0, posinf=0.0, neginf=0.0)
-    abs_delta_pressure = np.nan_to_num(abs_delta_pressure, nan=0.0, posinf=0.0, neginf=0.0)
-
     name_to_array: Dict[str, np.ndarray] = {
         "t": t,
         "x": x,
@@ -267,6 +262,14 @@ def apply_feature_pipeline(seq: torch.Tensor, pipeline: List[str]) -> torch.Tens
         "abs_delta_pressure": abs_delta_pressure,
     }
 
+    # Built-in channels are covered by the single sanitization pass on the stacked
+    # output; custom features combine intermediates, so those are cleaned (in place)
+    # before the callbacks see them - only when a custom feature is requested.
+    if any(name not in name_to_array and name in FEATURE_REGISTRY for name in pipeline):
+        for key in ("vx", "vy", "ax", "ay", "jx", "jy", "jerk",
+                    "prate", "path_velocity", "path_tangent_angle", "abs_delta_pressure"):
+            np.nan_to_num(name_to_array[key], copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+
     channels: List[np.ndarray] = []
     for name in pipeline:
         if name in name_to_array:
@@ -289,9 +292,12 @@ def apply_feature_pipeline(seq: torch.Tensor, pipeline: List[str]) -> torch.Tens
 
     out = np.stack(channels, axis=1)
     
-    # Final check for NaN/Inf values
-    if np.isnan(out).any() or np.isinf(out).any():
-        print(f"Warning: NaN/Inf detected in features. Replacing with zeros.")
+    # Single NaN/Inf sanitization pass over the stacked output
+    # (covers every emitted channel, so intermediates are not cleaned one by one)
+    if not np.isfinite(out).all():
+        if not _warned_non_finite:
+            logger.warning("NaN/Inf detected in features; replacing with zeros (reported once)")
+            _warned_non_finite = True
         out = np.nan_to_num(out, nan=0.0, posinf=0.0, neginf=0.0)
     
     return torch.from_numpy(out).type_as(seq)
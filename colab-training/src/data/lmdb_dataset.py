@@ -1,5 +1,6 @@
 from typing import Callable, Optional, Tuple, List
 import io
+import os
 import lmdb
 import csv
 import numpy as np
@@ -7,6 +8,9 @@ import torch
 from torch.utils.data import Dataset
 
 
+_USER_CODE_SUFFIX = b":user_code"
+
+
 class LmdbSignatureDataset(Dataset):
     """
     LMDB-backed dataset for signature verification experiments.
@@ -35,21 +39,69 @@ class LmdbSignatureDataset(Dataset):
         self.feature_pipeline = feature_pipeline or ["t", "x", "y", "p"]
         self._apply_features = apply_feature_pipeline
 
-        self.env = lmdb.open(
-            lmdb_path, readonly=True, lock=False, readahead=True, max_readers=2048
-        )
+        # The env is opened lazily per process (see _open_lmdb): a handle inherited
+        # across fork must not be used by DataLoader workers.
+        self.env = None
+        self._env_pid: Optional[int] = None
 
-        with self.env.begin() as txn:
+        with self._open_lmdb().begin() as txn:
             index_bytes = txn.get(b"__index__")
             if index_bytes is None:
                 raise RuntimeError(f"LMDB index not found at {lmdb_path}")
             self.keys = [k for k in index_bytes.decode("utf-8").splitlines() if k]
+        self._length = len(self.keys)
 
         self.transform = transform
         self.return_user_code = return_user_code
+        self._user_codes: Optional[np.ndarray] = None
+        self._user_ids: Optional[np.ndarray] = None
+
+    def _open_lmdb(self) -> "lmdb.Environment":
+        """
+        LMDB environment of the current process, opened on first use.
+        Called from the DataLoader worker_init_fn, so each (persistent) worker opens
+        its env exactly once; a handle inherited from the parent is reopened.
+        """
+        pid = os.getpid()
+        if self.env is None or self._env_pid != pid:
+            self.env = lmdb.open(
+                self.lmdb_path, readonly=True, lock=False, readahead=True, max_readers=2048
+            )
+            self._env_pid = pid
+        return self.env
+
+    def __getstate__(self):
+        # LMDB handles are not picklable (spawn start method): workers reopen lazily
+        state = self.__dict__.copy()
+        state["env"] = None
+        state["_env_pid"] = None
+        return state
 
     def __len__(self) -> int:
-        return len(self.keys)
+        return self._length
+
+    def user_codes(self) -> np.ndarray:
+        """
+        User code of every sample, in index order, as a numpy string array.
+        Decodes only the f"{K}:user_code" values (no CSV decode / feature pipeline);
+        the result is cached after the first call.
+        """
+        if self._user_codes is None:
+            by_key = {}
+            # One sequential cursor sweep over the B+-tree instead of N key lookups.
+            # buffers=True: keys/values are memoryviews into the mmap, so skipping the
+            # CSV entries costs no copy.
+            with self._open_lmdb().begin(buffers=True) as txn:
+                for raw_key, value in txn.cursor().iternext(keys=True, values=True):
+                    if raw_key[-len(_USER_CODE_SUFFIX):] == _USER_CODE_SUFFIX:
+                        sample_key = str(raw_key[:-len(_USER_CODE_SUFFIX)], "utf-8")
+                        by_key[sample_key] = str(value, "utf-8")
+            self._user_codes = np.array([by_key.get(key, "") for key in self.keys], dtype=str)
+        return self._user_codes
+
+    def get_user_code(self, index: int) -> str:
+        """User code of a single sample without decoding its signature data."""
+        return str(self.user_codes()[index])
 
     def __getitem__(self, index: int) -> Tuple[torch.Tensor, torch.Tensor, int] | Tuple[torch.Tensor, torch.Tensor, int, str]:
         """
@@ -60,14 +112,12 @@ class LmdbSignatureDataset(Dataset):
             user_code: (optional) string user code
         """
         key = self.keys[index]
-        with self.env.begin() as txn:
+        with self._open_lmdb().begin() as txn:
             csv_bytes = txn.get(key.encode("utf-8"))
             if csv_bytes is None:
                 raise KeyError(f"Missing CSV data for key {key}")
-            label_bytes = txn.get(f"{key}:label".encode("utf-8"))
-            label = label_bytes.decode("utf-8") if label_bytes else ""
-            user_code_bytes = txn.get(f"{key}:user_code".encode("utf-8"))
-            user_code = user_code_bytes.decode("utf-8") if user_code_bytes else ""
+        # Labels come from the precomputed tables, not from per-sample LMDB reads
+        user_code = self.get_user_code(index)
 
         # Parse CSV data
         csv_text = csv_bytes.decode("utf-8")
@@ -78,7 +128,7 @@ class LmdbSignatureDataset(Dataset):
             # Return empty tensor if no data
             empty = torch.zeros((self.max_sequence_length, len(self.feature_pipeline)), dtype=torch.float32)
             mask = torch.zeros(self.max_sequence_length, dtype=torch.bool)
-            user_id = self._get_user_id(user_code)
+            user_id = self._get_user_id(index)
             return (empty, mask, user_id, user_code) if self.return_user_code else (empty, mask, user_id)
         
         # Skip header row, parse data
@@ -100,7 +150,7 @@ class LmdbSignatureDataset(Dataset):
         if not coordinates:
             empty = torch.zeros((self.max_sequence_length, len(self.feature_pipeline)), dtype=torch.float32)
             mask = torch.zeros(self.max_sequence_length, dtype=torch.bool)
-            user_id = self._get_user_id(user_code)
+            user_id = self._get_user_id(index)
             return (empty, mask, user_id, user_code) if self.return_user_code else (empty, mask, user_id)
         
         # Convert to numpy array
@@ -108,7 +158,7 @@ class LmdbSignatureDataset(Dataset):
         original_len = len(coords_array)
         
         # Check for extreme values in raw data
-        if np.isnan(coords_array).any() or np.isinf(coords_array).any():
+        if not np.isfinite(coords_array).all():
             print(f"Warning: NaN/Inf detected in raw data for user {user_code}. Replacing with zeros.")
             coords_array = np.nan_to_num(coords_array, nan=0.0, posinf=0.0, neginf=0.0)
         
@@ -145,20 +195,26 @@ class LmdbSignatureDataset(Dataset):
             tensor = self.transform(tensor)
 
         # Convert user_code to integer user_id for triplet learning
-        user_id = self._get_user_id(user_code)
+        user_id = self._get_user_id(index)
 
         if self.return_user_code:
             return tensor, mask, user_id, user_code
         return tensor, mask, user_id
 
-    def _get_user_id(self, user_code: str) -> int:
-        """Convert user_code string to integer user_id for triplet learning."""
-        if not user_code:
-            return 0
-        
-        # Simple hash-based conversion to integer
-        # This ensures consistent user_id for the same user_code
-        return hash(user_code) % (2**31)  # Keep within int32 range
+    def _get_user_id(self, index: int) -> int:
+        """Integer user_id of a sample for triplet learning (lookup in the precomputed table)."""
+        return int(self.user_ids()[index])
+
+    def user_ids(self) -> np.ndarray:
+        """
+        Integer user_id of every sample, in index order, as an int64 array.
+        Ids are contiguous and derived from the sorted unique user codes, so they are
+        identical across processes (unlike the previous per-process str hash).
+        """
+        if self._user_ids is None:
+            _, inverse = np.unique(self.user_codes(), return_inverse=True)
+            self._user_ids = inverse.astype(np.int64)
+        return self._user_ids
 
     @staticmethod
     def collate_fn(batch):
@@ -179,7 +235,7 @@ class LmdbSignatureDataset(Dataset):
         # Stack tensors (all have same size now)
         x_batch = torch.stack(tensors, dim=0)  # (B, T_max, F)
         mask = torch.stack(masks, dim=0)       # (B, T_max)
-        labels = torch.tensor(user_ids, dtype=torch.long)  # (B,)
+        labels = torch.from_numpy(np.fromiter(user_ids, dtype=np.int64, count=len(user_ids)))  # (B,)
         
         return x_batch, labels, mask
 
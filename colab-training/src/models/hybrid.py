@@ -99,8 +99,10 @@ class SignatureEncoder(nn.Module):
         pooled, attn_weights = self.attn(out, mask=mask)  # (B, 2*gru_hidden)
         emb = self.fc(pooled)  # (B, emb_dim)
         
-        # Check for NaN/Inf - should not happen with proper feature preprocessing
-        if torch.isnan(emb).any() or torch.isinf(emb).any():
+        # Check for NaN/Inf - should not happen with proper feature preprocessing.
+        # Training only: in eval the caller validates all embeddings once after the loop,
+        # so inference batches skip this host sync.
+        if self.training and not torch.isfinite(emb).all():
             raise RuntimeError("NaN/Inf detected in embeddings. This indicates a problem in feature preprocessing.")
         
         emb = F.normalize(emb, p=2, dim=-1)  # L2 normalize
@@ -0,0 +1,61 @@
+"""
+Tests for the class-balanced PK sampler.
+"""
+
+import os
+import sys
+
+import numpy as np
+
+# make `training` importable when running pytest from the repo root
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from training.sampling import PKSampler
+
+
+def _labels():
+    # identity "e" (indices 15-17) has fewer than K=4 samples
+    return ["a"] * 5 + ["b"] * 4 + ["c"] * 6 + ["e"] * 3 + ["d"] * 7
+
+
+def test_batches_have_p_identities_with_k_samples():
+    labels = _labels()
+    sampler = PKSampler(labels, P=2, K=4, seed=0)
+    batches = list(sampler)
+
+    assert len(batches) == len(sampler) == 3
+    seen = set()
+    for batch in batches:
+        identities = [labels[i] for i in batch]
+        for identity in set(identities):
+            assert identities.count(identity) == 4
+        seen.update(identities)
+    assert seen == set(labels)
+
+
+def test_large_pools_have_no_repeats():
+    labels = _labels()
+    for seed in range(20):
+        for batch in PKSampler(labels, P=5, K=4, seed=seed):
+            for identity in ("a", "b", "c", "d"):
+                picked = [i for i in batch if labels[i] == identity]
+                assert len(set(picked)) == 4
+
+
+def test_small_pool_uses_every_sample():
+    labels = _labels()
+    for seed in range(50):
+        for batch in PKSampler(labels, P=5, K=4, seed=seed):
+            slot = [i for i in batch if labels[i] == "e"]
+            assert len(slot) == 4
+            assert set(slot) == {15, 16, 17}
+
+
+def test_seed_is_reproducible():
+    labels = _labels()
+    first = list(PKSampler(labels, P=2, K=4, seed=7))
+    assert first == list(PKSampler(labels, P=2, K=4, seed=7))
+
+    sampler = PKSampler(labels, P=2, K=4, seed=1)
+    sampler.reshuffle(7)
+    assert list(sampler) == first
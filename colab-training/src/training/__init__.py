@@ -1,8 +1,8 @@
 from .runner import TrainingRunner
 from .engine import train_one_epoch, evaluate
 from .miners import TripletMiner
-from .metrics import compute_eer_auc
+from .metrics import compute_eer_auc, compute_eer_auc_torch
 
-__all__ = ["TrainingRunner", "train_one_epoch", "evaluate", "TripletMiner", "compute_eer_auc"]
+__all__ = ["TrainingRunner", "train_one_epoch", "evaluate", "TripletMiner", "compute_eer_auc", "compute_eer_auc_torch"]
 
 
@@ -1,32 +1,87 @@
 # src/training/engine.py
+import os
+from contextlib import nullcontext
+
+# Must be set before the first CUDA allocation; expandable segments reduce fragmentation OOMs.
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True")
+
 import torch
 from torch.amp import autocast, GradScaler
 from tqdm import tqdm
-import numpy as np
 import logging
 from typing import Dict, Any, Optional, Tuple
 import time
 
-from .metrics import compute_eer_auc
+from .metrics import compute_eer_auc_torch
+
+
+def resolve_amp_dtype() -> torch.dtype:
+    """Pick the autocast dtype: bfloat16 on Ampere+ GPUs, float16 otherwise."""
+    if torch.cuda.is_available() and torch.cuda.is_bf16_supported():
+        return torch.bfloat16
+    return torch.float16
+
+
+class CUDAPrefetcher:
+    """
+    Wraps a DataLoader and copies the next batch to the GPU on a side stream,
+    so the H2D transfer overlaps with the current step's forward/backward.
+    Yields the same tuples as the loader, with tensors already on `device`.
+    """
+
+    def __init__(self, loader, device):
+        self.loader = loader
+        self.device = torch.device(device)
+        self.stream = torch.cuda.Stream(device=self.device)
+
+    def __len__(self):
+        return len(self.loader)
+
+    def _preload(self, it):
+        try:
+            batch = next(it)
+        except StopIteration:
+            return None
+        with torch.cuda.stream(self.stream):
+            return tuple(
+                t.to(self.device, non_blocking=True) if isinstance(t, torch.Tensor) else t
+                for t in batch
+            )
+
+    def __iter__(self):
+        it = iter(self.loader)
+        batch = self._preload(it)
+        while batch is not None:
+            current = torch.cuda.current_stream(self.device)
+            current.wait_stream(self.stream)
+            for t in batch:
+                if isinstance(t, torch.Tensor):
+                    # memory was allocated on the side stream; keep it alive for the compute stream
+                    t.record_stream(current)
+            next_batch = self._preload(it)
+            yield batch
+            batch = next_batch
 
 
 def train_one_epoch(model, dataloader, optimizer, scheduler, miner, loss_fn,
                     device, scaler: GradScaler = None, grad_accum_steps: int = 1,
-                    logger: Optional[logging.Logger] = None, log_frequency: int = 50) -> Dict[str, Any]:
+                    logger: Optional[logging.Logger] = None, log_frequency: int = 50,
+                    amp_dtype: Optional[torch.dtype] = None) -> Dict[str, Any]:
     """
     Train model for one epoch with comprehensive error handling and metrics logging.
     
     Args:
         model: Model to train
-        dataloader: Training data loader
-        optimizer: Optimizer
+        dataloader: Training data loader (pin_memory=True for async H2D copies)
+        optimizer: Optimizer (grads are reset with zero_grad(set_to_none=True))
         scheduler: Learning rate scheduler
         miner: Triplet miner
         loss_fn: Loss function
         device: Device to train on
-        scaler: Gradient scaler for AMP
+        scaler: Gradient scaler for AMP (only used for float16 autocast)
         grad_accum_steps: Gradient accumulation steps
         logger: Logger instance
+        amp_dtype: Autocast dtype; None => bfloat16 if the GPU supports it, else float16
         
     Returns:
         Dictionary with epoch metrics
@@ -35,54 +90,73 @@ def train_one_epoch(model, dataloader, optimizer, scheduler, miner, loss_fn,
         logger = logging.getLogger(__name__)
     
     model.train()
-    running_loss = 0.0
-    optimizer.zero_grad()
+    optimizer.zero_grad(set_to_none=True)
     
-    if scaler is None:
-        scaler = GradScaler()
+    if amp_dtype is None:
+        amp_dtype = resolve_amp_dtype()
+    # bfloat16 has the fp32 exponent range, so loss scaling is only needed for float16
+    use_scaler = amp_dtype == torch.float16
+    if use_scaler and scaler is None:
+        scaler = GradScaler('cuda')
     
-    # Initialize metrics tracking
+    # Initialize metrics tracking.
+    # Per-batch tensor stats live in pre-allocated device buffers (no .item() per step);
+    # host-side values (timings, LR) and counters stay as plain Python objects.
+    num_batches = len(dataloader)
     epoch_metrics = {
-        "losses": [],
-        "grad_norms": [],
-        "triplet_counts": [],
+        "losses": torch.zeros(num_batches, device=device),
+        "grad_norms": torch.zeros(num_batches, device=device),
+        "triplet_counts": torch.zeros(num_batches, device=device),
         "batch_times": [],
         "learning_rates": [],
-        "margin_violations": [],
-        "avg_anchor_pos_dists": [],
-        "avg_anchor_neg_dists": [],
+        "margin_violations": torch.zeros(num_batches, device=device),
+        "avg_anchor_pos_dists": torch.zeros(num_batches, device=device),
+        "avg_anchor_neg_dists": torch.zeros(num_batches, device=device),
+        "optimizer_steps": 0,
         "valid_batches": 0,
         "total_batches": 0,
         "oom_errors": 0,
         "nan_losses": 0,
         "nan_embeddings": 0,
-        "nan_distances": 0,
         "empty_triplets": 0
     }
     
     step = 0
+    channels_last = False
     start_time = time.time()
     
     logger.info(f"Starting training epoch with {len(dataloader)} batches")
     logger.info(f"Gradient accumulation steps: {grad_accum_steps}")
     
-    for batch_idx, batch in enumerate(tqdm(dataloader, desc="train")):
+    # On CUDA the next batch is copied on a side stream while this one trains;
+    # the .to(device) calls below are then no-ops
+    batches = CUDAPrefetcher(dataloader, device) if torch.device(device).type == "cuda" else dataloader
+    
+    for batch_idx, batch in enumerate(tqdm(batches, desc="train", total=num_batches)):
         batch_start_time = time.time()
         epoch_metrics["total_batches"] += 1
         
         try:
             x, labels, mask = batch  # expected collate -> x: (B,T,F), labels: (B,)
-            x = x.to(device, non_blocking=True)
-            labels = labels.to(device)
+            if x.dim() == 4:
+                # image-like inputs: NHWC lets cuDNN use the tensor-core conv path
+                if not channels_last:
+                    model.to(memory_format=torch.channels_last)
+                    channels_last = True
+                x = x.to(device, non_blocking=True, memory_format=torch.channels_last)
+            else:
+                # (B, T, F) sequences have no channels_last layout
+                x = x.to(device, non_blocking=True)
+            labels = labels.to(device, non_blocking=True)
             if mask is not None:
-                mask = mask.to(device)
+                mask = mask.to(device, non_blocking=True)
             
             # Forward pass with AMP
-            with autocast('cuda'):
+            with autocast('cuda', dtype=amp_dtype):
                 emb = model(x, mask)
                 
-                # Debug: check embeddings for NaN/Inf
-                if torch.isnan(emb).any() or torch.isinf(emb).any():
+                # Debug: check embeddings for NaN/Inf (one isfinite pass)
+                if not torch.isfinite(emb).all():
                     logger.error(f"Batch {batch_idx}: NaN/Inf detected in embeddings")
                     logger.error(f"  Embedding stats: min={emb.min().item():.6f}, max={emb.max().item():.6f}")
                     logger.error(f"  Input stats: min={x.min().item():.6f}, max={x.max().item():.6f}")
@@ -97,16 +171,11 @@ def train_one_epoch(model, dataloader, optimizer, scheduler, miner, loss_fn,
                     logger.warning(f"Batch {batch_idx}: No triplets found, skipping")
                     continue
                 
-                # Debug: check triplet distances
+                # Triplet distance stats (kept on device; embeddings were checked finite above
+                # and a non-finite loss is caught below, so no extra host sync here)
                 pos_dist = torch.cdist(a, p, p=2).mean()
                 neg_dist = torch.cdist(a, n, p=2).mean()
                 
-                if torch.isnan(pos_dist) or torch.isinf(pos_dist) or torch.isnan(neg_dist) or torch.isinf(neg_dist):
-                    logger.error(f"Batch {batch_idx}: NaN/Inf in triplet distances")
-                    logger.error(f"  Pos dist: {pos_dist.item():.6f}, Neg dist: {neg_dist.item():.6f}")
-                    epoch_metrics["nan_distances"] += 1
-                    continue
-                
                 loss = loss_fn(a, p, n)
             
             # Check for invalid loss values
@@ -120,25 +189,30 @@ def train_one_epoch(model, dataloader, optimizer, scheduler, miner, loss_fn,
                 logger.error("This usually indicates model collapse or numerical instability.")
                 raise RuntimeError(f"Invalid loss value: {loss.item()}. Training stopped.")
             
-            # Compute mining metrics
-            anchor_pos_dist = torch.cdist(a, p, p=2).mean().item()
-            anchor_neg_dist = torch.cdist(a, n, p=2).mean().item()
-            margin_violations = 1 if (anchor_neg_dist - anchor_pos_dist < miner.margin) and hasattr(miner, 'margin') else 0
+            # Store mining metrics (reuse the distances computed above, stay on device)
+            slot = epoch_metrics["valid_batches"]
+            epoch_metrics["avg_anchor_pos_dists"][slot] = pos_dist.detach()
+            epoch_metrics["avg_anchor_neg_dists"][slot] = neg_dist.detach()
+            if hasattr(miner, 'margin'):
+                epoch_metrics["margin_violations"][slot] = (neg_dist.detach() - pos_dist.detach() < miner.margin)
+            epoch_metrics["triplet_counts"][slot] = a.size(0)
             
-            # Store mining metrics
-            epoch_metrics["avg_anchor_pos_dists"].append(anchor_pos_dist)
-            epoch_metrics["avg_anchor_neg_dists"].append(anchor_neg_dist)
-            epoch_metrics["margin_violations"].append(margin_violations)
-            epoch_metrics["triplet_counts"].append(a.size(0))
-            
-            # Backward pass with gradient accumulation
+            # Backward pass with gradient accumulation.
+            # Under DDP, skip the gradient all-reduce on every micro-step but the last of the window.
             loss = loss / grad_accum_steps
-            scaler.scale(loss).backward()
+            accumulating = (step + 1) % grad_accum_steps != 0
+            sync_ctx = model.no_sync() if accumulating and hasattr(model, "no_sync") else nullcontext()
+            with sync_ctx:
+                if use_scaler:
+                    scaler.scale(loss).backward()
+                else:
+                    loss.backward()
             step += 1
             
             if step % grad_accum_steps == 0:
                 # Gradient clipping
-                scaler.unscale_(optimizer)
+                if use_scaler:
+                    scaler.unscale_(optimizer)
                 grad_norm = torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm=1.0)
                 
                 # Check for gradient explosion
@@ -148,9 +222,12 @@ def train_one_epoch(model, dataloader, optimizer, scheduler, miner, loss_fn,
                     logger.error("This indicates severe numerical instability in the model.")
                     raise RuntimeError(f"Invalid gradient norm: {grad_norm}. Training stopped.")
                 
-                scaler.step(optimizer)
-                scaler.update()
-                optimizer.zero_grad()
+                if use_scaler:
+                    scaler.step(optimizer)
+                    scaler.update()
+                else:
+                    optimizer.step()
+                optimizer.zero_grad(set_to_none=True)
                 
                 # Scheduler step with error handling
                 if scheduler is not None:
@@ -161,11 +238,12 @@ def train_one_epoch(model, dataloader, optimizer, scheduler, miner, loss_fn,
                         # Continue training even if scheduler fails
                 
                 # Store metrics
-                epoch_metrics["grad_norms"].append(grad_norm.item())
+                epoch_metrics["grad_norms"][epoch_metrics["optimizer_steps"]] = grad_norm.detach()
+                epoch_metrics["optimizer_steps"] += 1
                 epoch_metrics["learning_rates"].append(optimizer.param_groups[0]['lr'])
             
             # Store loss and timing
-            epoch_metrics["losses"].append(loss.item() * grad_accum_steps)
+            epoch_metrics["losses"][slot] = loss.detach() * grad_accum_steps
             epoch_metrics["valid_batches"] += 1
             
             batch_time = time.time() - batch_start_time
@@ -185,7 +263,6 @@ def train_one_epoch(model, dataloader, optimizer, scheduler, miner, loss_fn,
                 logger.error(f"Batch {batch_idx}: CUDA out of memory")
                 logger.error("CRITICAL ERROR: GPU memory exhausted. Training cannot continue.")
                 logger.error("Solutions: reduce batch size, increase grad_accum_steps, or use smaller model.")
-                torch.cuda.empty_cache()
                 raise RuntimeError(f"CUDA OOM at batch {batch_idx}. Training stopped. "
                                  f"Consider reducing batch size or increasing grad_accum_steps.")
             else:
@@ -199,9 +276,11 @@ def train_one_epoch(model, dataloader, optimizer, scheduler, miner, loss_fn,
     
     # Calculate final metrics
     total_time = time.time() - start_time
-    avg_loss = np.mean(epoch_metrics["losses"]) if epoch_metrics["losses"] else 0.0
-    avg_grad_norm = np.mean(epoch_metrics["grad_norms"]) if epoch_metrics["grad_norms"] else 0.0
-    avg_triplets = np.mean(epoch_metrics["triplet_counts"]) if epoch_metrics["triplet_counts"] else 0.0
+    valid = epoch_metrics["valid_batches"]
+    steps = epoch_metrics["optimizer_steps"]
+    avg_loss = epoch_metrics["losses"][:valid].mean().item() if valid else 0.0
+    avg_grad_norm = epoch_metrics["grad_norms"][:steps].mean().item() if steps else 0.0
+    avg_triplets = epoch_metrics["triplet_counts"][:valid].mean().item() if valid else 0.0
     
     # Log epoch summary
     logger.info(f"Epoch completed: {epoch_metrics['valid_batches']}/{epoch_metrics['total_batches']} batches")
@@ -230,16 +309,21 @@ def train_one_epoch(model, dataloader, optimizer, scheduler, miner, loss_fn,
     }
 
 
-@torch.no_grad()
-def evaluate(model, dataloader, device, logger: Optional[logging.Logger] = None) -> Tuple[float, float]:
+@torch.inference_mode()
+def evaluate(model, dataloader, device, logger: Optional[logging.Logger] = None,
+             amp_dtype: Optional[torch.dtype] = None,
+             mixed_precision: bool = True) -> Tuple[float, float]:
     """
     Evaluate model on validation set with comprehensive error handling.
     
     Args:
         model: Model to evaluate
-        dataloader: Validation data loader
+        dataloader: Validation data loader (should use pin_memory=True so that
+            non_blocking host-to-device copies can overlap with compute)
         device: Device to evaluate on
         logger: Logger instance
+        amp_dtype: Autocast dtype for the forward pass; None => same choice as training
+        mixed_precision: Run the forward under autocast (CUDA only); False => full fp32
         
     Returns:
         Tuple of (EER, AUC) metrics
@@ -247,47 +331,68 @@ def evaluate(model, dataloader, device, logger: Optional[logging.Logger] = None)
     if logger is None:
         logger = logging.getLogger(__name__)
     
+    # eval() + no_grad is all that is needed here: no cache flushes or requires_grad toggling
+    was_training = model.training
     model.eval()
-    all_emb = []
-    all_labels = []
+    # Embeddings are written into one buffer sized from the dataset (allocated on the
+    # first batch, once the embedding dim is known) instead of list + torch.cat.
+    total = len(dataloader.dataset)
+    all_emb = None
+    all_labels = torch.empty(total, dtype=torch.long, device=device)
+    offset = 0
+    
+    if amp_dtype is None:
+        amp_dtype = resolve_amp_dtype()
+    on_cuda = torch.device(device).type == "cuda"
     
     logger.info(f"Starting evaluation with {len(dataloader)} batches")
     
     try:
-        for batch_idx, batch in enumerate(tqdm(dataloader, desc="eval")):
+        # Overlap the next batch's H2D copy with this batch's forward (same as training)
+        batches = CUDAPrefetcher(dataloader, device) if on_cuda else dataloader
+        for batch_idx, batch in enumerate(tqdm(batches, desc="eval", total=len(dataloader))):
             try:
                 x, labels, mask = batch
-                x = x.to(device)
+                x = x.to(device, non_blocking=True)
                 if mask is not None:
-                    mask = mask.to(device)
+                    mask = mask.to(device, non_blocking=True)
                 
-                emb = model(x, mask)
+                with autocast('cuda', dtype=amp_dtype, enabled=on_cuda and mixed_precision):
+                    emb = model(x, mask)
+                # scores are computed in fp32 (the buffer below is float32)
+                emb = emb.float()
                 
-                # Check for invalid embeddings
-                if torch.isnan(emb).any() or torch.isinf(emb).any():
-                    logger.error(f"Batch {batch_idx}: Invalid embeddings detected")
-                    logger.error("CRITICAL ERROR: NaN/Inf embeddings. Evaluation cannot continue.")
-                    raise RuntimeError("Invalid embeddings detected during evaluation.")
-                
-                all_emb.append(emb.cpu())
-                all_labels.append(labels)
+                if all_emb is None:
+                    all_emb = torch.empty(total, emb.size(1), dtype=torch.float32, device=device)
+                b = emb.size(0)
+                all_emb[offset:offset + b] = emb
+                all_labels[offset:offset + b] = labels.to(device, non_blocking=True)
+                offset += b
                 
             except Exception as e:
                 logger.error(f"Batch {batch_idx}: Error during evaluation: {e}")
                 logger.error("CRITICAL ERROR: Evaluation failed. Cannot compute metrics.")
                 raise e
         
-        if not all_emb:
+        if offset == 0:
             logger.error("No embeddings collected during evaluation")
             raise RuntimeError("No embeddings collected during evaluation.")
         
-        all_emb = torch.cat(all_emb, dim=0)
-        all_labels = torch.cat(all_labels, dim=0)
+        all_emb = all_emb[:offset]
+        all_labels = all_labels[:offset]
+        
+        # Check for invalid embeddings once, on device, instead of syncing every batch
+        finite_rows = torch.isfinite(all_emb).all(dim=1)
+        if not bool(finite_rows.all()):
+            bad = (~finite_rows).nonzero().squeeze(1)
+            logger.error(f"Invalid embeddings detected for {bad.numel()} samples (first index {bad[0].item()})")
+            logger.error("CRITICAL ERROR: NaN/Inf embeddings. Evaluation cannot continue.")
+            raise RuntimeError("Invalid embeddings detected during evaluation.")
         
         logger.info(f"Evaluation completed: {all_emb.size(0)} samples")
         
-        # Compute metrics
-        eer, auc = compute_eer_auc(all_emb.numpy(), all_labels.numpy())
+        # Compute metrics (pair scores via tiled matmul on the evaluation device)
+        eer, auc = compute_eer_auc_torch(all_emb, all_labels)
         
         logger.info(f"EER: {eer:.4f}, AUC: {auc:.4f}")
         
@@ -296,3 +401,5 @@ def evaluate(model, dataloader, device, logger: Optional[logging.Logger] = None)
     except Exception as e:
         logger.error(f"Evaluation failed: {e}")
         raise e
+    finally:
+        model.train(was_training)
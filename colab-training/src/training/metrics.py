@@ -1,29 +1,151 @@
 # src/training/metrics.py
 import numpy as np
-from sklearn.metrics import roc_curve, roc_auc_score
+import torch
 
-def compute_eer_auc(embeddings: np.ndarray, labels: np.ndarray):
+try:
+    from numba import njit
+except ImportError:  # numba is optional; fall back to the numpy scan
+    njit = None
+
+def compute_eer_auc(embeddings: np.ndarray, labels: np.ndarray, block_size: int = 4096):
     """
     embeddings: (N, D) numpy
     labels: (N,) numpy ints
+    block_size: rows per similarity tile (peak memory is O(block_size * N), not O(N^2))
     returns: eer (float in [0,1]), auc (float)
     """
-    # pairwise cosine similarity via dot (embeds assumed L2-normalized)
-    sim = embeddings @ embeddings.T
-    n = len(labels)
-    iu = np.triu_indices(n, k=1)
-    scores = sim[iu]
-    same = (labels[:, None] == labels[None, :])[iu].astype(int)
+    scores, same = _upper_triangle_pairs(embeddings, labels, block_size)
 
-    if len(np.unique(same)) == 1:
+    if same.all() or not same.any():
         # degenerate case
         return 1.0, 0.5
 
-    fpr, tpr, thr = roc_curve(same, scores)
-    auc = float(roc_auc_score(same, scores))
+    return _eer_auc_from_scores(scores, same)
+
+
+@torch.no_grad()
+def compute_eer_auc_torch(embeddings: torch.Tensor, labels: torch.Tensor, block_size: int = 4096):
+    """
+    Same as compute_eer_auc, but pair scoring runs on the tensors' device:
+    one GEMM per tile instead of copying the embeddings to the host first.
+    embeddings: (N, D) tensor, labels: (N,) tensor
+    """
+    scores, same = _upper_triangle_pairs_torch(embeddings, labels, block_size)
 
+    if same.all() or not same.any():
+        # degenerate case
+        return 1.0, 0.5
+
+    return _eer_auc_from_scores(scores, same)
+
+
+def _upper_triangle_pairs_torch(embeddings: torch.Tensor, labels: torch.Tensor, block_size: int):
+    """Tiled on-device version of _upper_triangle_pairs; tiles are streamed into host buffers."""
+    n = labels.size(0)
+    scores = np.empty(n * (n - 1) // 2, dtype=np.float32)
+    same = np.empty_like(scores, dtype=np.int8)
+    embeddings = embeddings.float()
+
+    offset = 0
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        sim_block = embeddings[start:stop] @ embeddings[start:].T  # (b, n - start)
+        same_block = labels[start:stop, None] == labels[None, start:]
+        # strictly-upper part of the tile, row-major == np.triu_indices order
+        upper = torch.ones_like(same_block).triu_(diagonal=1)
+        count = (stop - start) * (2 * n - start - stop - 1) // 2
+        scores[offset:offset + count] = sim_block[upper].cpu().numpy()
+        same[offset:offset + count] = same_block[upper].cpu().numpy()
+        offset += count
+    return scores, same
+
+
+def _upper_triangle_pairs(embeddings: np.ndarray, labels: np.ndarray, block_size: int):
+    """
+    Pair scores and same-label flags for all i < j, in np.triu_indices order.
+    Cosine similarity via dot (embeds assumed L2-normalized), computed tile by tile.
+    """
+    n = len(labels)
+    scores = np.empty(n * (n - 1) // 2, dtype=np.float32)
+    same = np.empty_like(scores, dtype=np.int8)
+
+    offset = 0
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        sim_block = embeddings[start:stop] @ embeddings[start:].T  # (b, n - start)
+        for r, i in enumerate(range(start, stop)):
+            count = n - i - 1
+            scores[offset:offset + count] = sim_block[r, r + 1:]
+            same[offset:offset + count] = labels[i + 1:] == labels[i]
+            offset += count
+    return scores, same
+
+
+def _eer_auc_from_scores(scores: np.ndarray, same: np.ndarray):
+    """
+    EER and ROC AUC from a single descending sort of the pair scores.
+    Equivalent to sklearn's roc_curve + roc_auc_score, without sorting twice.
+    """
+    order = np.argsort(-scores, kind="stable")
+    scores = scores[order]
+    y = same[order]
+
+    if _eer_auc_scan is not None:
+        n_pos = int(np.count_nonzero(y))
+        eer, auc = _eer_auc_scan(scores, y, n_pos, y.size - n_pos)
+        return float(eer), float(auc)
+
+    tp = np.cumsum(y)
+    fp = np.cumsum(1 - y)
+    # tied scores share one threshold: keep the last point of each tie group
+    distinct = np.r_[np.flatnonzero(np.diff(scores)), y.size - 1]
+    tp = np.r_[0, tp[distinct]]
+    fp = np.r_[0, fp[distinct]]
+
+    tpr = tp / tp[-1]
+    fpr = fp / fp[-1]
     fnr = 1 - tpr
+
+    # trapezoidal area under the ROC (ties contribute their diagonal segment)
+    auc = float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1])) / 2.0)
+
     # find threshold where |FNR - FPR| minimal
     idx = np.nanargmin(np.abs(fnr - fpr))
     eer = float((fpr[idx] + fnr[idx]) / 2.0)
-    return eer, auc
\ No newline at end of file
+    return eer, auc
+
+
+if njit is not None:
+    @njit(cache=True, fastmath=True)
+    def _eer_auc_scan(scores_sorted, y_sorted, n_pos, n_neg):
+        """Single pass over descending scores: running TP/FP, EER point and trapezoidal AUC."""
+        tp = 0
+        fp = 0
+        prev_tpr = 0.0
+        prev_fpr = 0.0
+        # start of the curve (threshold above every score): FPR = 0, FNR = 1
+        best_diff = 1.0
+        eer = 0.5
+        auc = 0.0
+        n = y_sorted.shape[0]
+        for i in range(n):
+            if y_sorted[i]:
+                tp += 1
+            else:
+                fp += 1
+            # tied scores share one threshold: only the last of a tie group is a curve point
+            if i + 1 < n and scores_sorted[i + 1] == scores_sorted[i]:
+                continue
+            tpr = tp / n_pos
+            fpr = fp / n_neg
+            fnr = 1.0 - tpr
+            diff = abs(fnr - fpr)
+            if diff < best_diff:
+                best_diff = diff
+                eer = (fpr + fnr) / 2.0
+            auc += (fpr - prev_fpr) * (tpr + prev_tpr) / 2.0
+            prev_tpr = tpr
+            prev_fpr = fpr
+        return eer, auc
+else:
+    _eer_auc_scan = None
@@ -26,49 +26,29 @@ class TripletMiner:
         labels = labels.view(-1, 1)
         same = (labels == labels.t())  # (B, B)
         diff = ~same
+        # remove self from positives
+        pos_mask = same & ~torch.eye(B, dtype=torch.bool, device=device)
+        valid = pos_mask.any(dim=1) & diff.any(dim=1)  # anchors with >=1 positive and negative
 
-        anchors, positives, negatives = [], [], []
-        for i in range(B):
-            pos_idx = torch.where(same[i])[0]
-            neg_idx = torch.where(diff[i])[0]
-            # remove self
-            pos_idx = pos_idx[pos_idx != i]
-            if pos_idx.numel() == 0 or neg_idx.numel() == 0:
-                continue
-            pos_dists = dist[i][pos_idx]
-            neg_dists = dist[i][neg_idx]
-            # pick positive: nearest positive (easy choice)
-            p_rel = torch.argmin(pos_dists)
-            p = pos_idx[p_rel]
-            if self.mode == "semi-hard":
-                # semi-hard: neg such that d_pos < d_neg < d_pos + margin
-                d_pos = pos_dists[p_rel]
-                candidate_mask = (neg_dists > d_pos) & (neg_dists < d_pos + self.margin)
-                cand = torch.where(candidate_mask)[0]
-                if cand.numel() > 0:
-                    n_rel = cand[torch.randint(0, cand.numel(), (1,)).item()]
-                    n = neg_idx[n_rel]
-                else:
-                    # fallback to hardest neg
-                    n_rel = torch.argmin(neg_dists)
-                    n = neg_idx[n_rel]
-            elif self.mode == "hard":
-                # hardest negative (nearest negative)
-                n_rel = torch.argmin(neg_dists)
-                n = neg_idx[n_rel]
-            else:  # batch-all
-                # produce multiple triplets per anchor (not implemented heavy)
-                n_rel = torch.argmin(neg_dists)
-                n = neg_idx[n_rel]
+        # pick positive: nearest positive (easy choice)
+        d_pos, p_idx = dist.masked_fill(~pos_mask, float('inf')).min(dim=1)
+        # hardest negative (nearest negative), also the fallback for semi-hard
+        hard_n_idx = dist.masked_fill(~diff, float('inf')).argmin(dim=1)
 
-            anchors.append(i)
-            positives.append(p.item())
-            negatives.append(n.item())
+        if self.mode == "semi-hard":
+            # semi-hard: neg such that d_pos < d_neg < d_pos + margin
+            d_pos = d_pos.unsqueeze(1)
+            semi_mask = diff & (dist > d_pos) & (dist < d_pos + self.margin)
+            # uniform pick of one candidate per row, fully on-device (no .item() round-trip)
+            r = torch.rand(B, B, device=device).masked_fill_(~semi_mask, -1.0)
+            n_idx = torch.where(semi_mask.any(dim=1), r.argmax(dim=1), hard_n_idx)
+        else:  # "hard" and "batch-all" (multi-triplet batch-all is not implemented)
+            n_idx = hard_n_idx
 
-        if len(anchors) == 0:
+        if not bool(valid.any()):
             # fallback: random triplet
             return embeddings, embeddings, embeddings
-        a = embeddings[anchors]
-        p = embeddings[positives]
-        n = embeddings[negatives]
-        return a, p, n
\ No newline at end of file
+        a = embeddings[valid]
+        p = embeddings[p_idx[valid]]
+        n = embeddings[n_idx[valid]]
+        return a, p, n
@@ -1,6 +1,8 @@
 from dataclasses import dataclass
 from typing import Optional, Tuple
+import io
 import os
+import pickle
 import random
 import numpy as np
 import torch
@@ -8,14 +10,21 @@ from datetime import datetime
 import sys
 from datetime import datetime as _dt
 import logging
+import logging.handlers
 import json
 import csv
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from safetensors.torch import save_file as save_safetensors, load_file as load_safetensors
+except ImportError:  # safetensors is optional; weights then stay inside the pickle
+    save_safetensors = load_safetensors = None
 
 from config import DatasetConfig, ModelConfig, TrainingConfig
 from data.lmdb_dataset import LmdbSignatureDataset
 from models.hybrid import SignatureEncoder
-from training.engine import train_one_epoch, evaluate
+from training.engine import train_one_epoch, evaluate, resolve_amp_dtype
 from training.miners import TripletMiner
 from training.sampling import PKSampler
 from torch.utils.data import DataLoader
@@ -33,6 +42,35 @@ def set_seed(seed: int) -> None:
     torch.cuda.manual_seed_all(seed)
 
 
+def configure_backends() -> None:
+    """Fastest kernels over bitwise determinism: cuDNN autotuning and TF32 matmuls/convs."""
+    torch.backends.cudnn.benchmark = True
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+    torch.set_float32_matmul_precision('high')
+
+
+def _cpu_snapshot(obj):
+    """Copy every tensor in a (nested) state dict to CPU so it can be serialized off-thread."""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {k: _cpu_snapshot(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_cpu_snapshot(v) for v in obj)
+    return obj
+
+
+def _worker_init(worker_id: int) -> None:
+    """DataLoader worker_init_fn: open the LMDB env once in the new worker process."""
+    info = torch.utils.data.get_worker_info()
+    dataset = info.dataset
+    # Split/sample wrappers keep the base dataset in `.dataset`
+    while not isinstance(dataset, LmdbSignatureDataset):
+        dataset = dataset.dataset
+    dataset._open_lmdb()
+
+
 def resolve_device(pref: Optional[str]) -> torch.device:
     """Resolve device from preference or auto-detect."""
     if pref is not None:
@@ -99,12 +137,15 @@ class TrainingRunner:
         """Setup logging to both console and file."""
         log_file_path = os.path.join(log_dir, "training.log")
         
-        # Configure root logger for file only
+        # Configure root logger for file only.
+        # FileHandler flushes after every record; the MemoryHandler in front of it batches
+        # INFO records and writes them out every 64 records, on WARNING+ or at exit.
+        file_handler = logging.FileHandler(log_file_path, mode='a', encoding='utf-8')
+        file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
         logging.basicConfig(
             level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
             handlers=[
-                logging.FileHandler(log_file_path, mode='a', encoding='utf-8'),
+                logging.handlers.MemoryHandler(capacity=64, flushLevel=logging.WARNING, target=file_handler),
             ]
         )
         
@@ -113,9 +154,8 @@ class TrainingRunner:
         
         # Create simple logging function for Colab compatibility
         def simple_log(message):
-            # Only print to console for Colab visibility
+            # Only print to console for Colab visibility (flushed explicitly at setup checkpoints)
             print(f"[{_dt.now().strftime('%H:%M:%S')}] {message}")
-            sys.stdout.flush()
         
         # Create file logging function for important messages
         def log_to_file(message):
@@ -137,11 +177,13 @@ class TrainingRunner:
         )
 
     def _create_optimizer(self, model: SignatureEncoder) -> AdamW:
-        """Create AdamW optimizer."""
+        """Create AdamW optimizer (single fused CUDA kernel per step when the model is on GPU)."""
+        on_cuda = next(model.parameters()).is_cuda
         return AdamW(
             model.parameters(),
             lr=self.train_cfg.learning_rate,
-            weight_decay=self.train_cfg.weight_decay
+            weight_decay=self.train_cfg.weight_decay,
+            fused=on_cuda
         )
 
     def _create_scheduler(self, optimizer: AdamW, steps_per_epoch: int) -> OneCycleLR:
@@ -164,37 +206,96 @@ class TrainingRunner:
 
     def _save_checkpoint(self, model, optimizer, scheduler, scaler, epoch, 
                         checkpoint_dir: str, is_best: bool = False):
-        """Save model checkpoint."""
-        checkpoint = {
+        """
+        Save model checkpoint.
+        The state is snapshotted to CPU here; serialization and the file write run on
+        the background save thread, so training continues with the next epoch.
+        """
+        checkpoint = _cpu_snapshot({
             'model': model.state_dict(),
             'optimizer': optimizer.state_dict(),
             'scheduler': scheduler.state_dict(),
-            'scaler': scaler.state_dict(),
+            'scaler': scaler.state_dict() if scaler is not None else None,
             'epoch': epoch,
-            'config': {
-                'dataset': self.dataset_cfg.__dict__,
-                'model': self.model_cfg.__dict__,
-                'training': self.train_cfg.__dict__
+        })
+        if is_best:
+            # render-inference rebuilds the encoder from checkpoint['config']['model'];
+            # the per-epoch resume checkpoint doesn't need it (the run config is in the logs)
+            checkpoint['config'] = {
+                'dataset': dict(self.dataset_cfg.__dict__),
+                'model': dict(self.model_cfg.__dict__),
+                'training': dict(self.train_cfg.__dict__)
             }
-        }
         
+        # best_by_eer.pt keeps the single-file format that render-inference loads;
+        # the resume checkpoint stores weights as safetensors when available
+        weights_path = None
         if is_best:
             path = os.path.join(checkpoint_dir, "best_by_eer.pt")
         else:
             path = os.path.join(checkpoint_dir, "last.pt")
-        
-        torch.save(checkpoint, path)
+            if save_safetensors is not None:
+                # epoch-suffixed, referenced from last.pt: the pair is switched by the
+                # single last.pt rename, so weights and optimizer state always match
+                weights_path = os.path.join(checkpoint_dir, f"last-epoch{epoch:04d}.safetensors")
+        
+        def _report_failure(future):
+            if future.exception() is not None:
+                self.log(f"Checkpoint save failed ({path}): {future.exception()}")
+        
+        self._save_pool.submit(self._write_checkpoint, checkpoint, path, weights_path).add_done_callback(_report_failure)
+
+    def _write_checkpoint(self, checkpoint: dict, path: str, weights_path: Optional[str] = None) -> None:
+        """Runs on the save thread."""
+        if weights_path is not None:
+            # Raw tensor dump for the weights (no pickling); the rest stays in the .pt
+            weights = {k: v.contiguous() for k, v in checkpoint.pop('model').items()}
+            save_safetensors(weights, weights_path + ".tmp")
+            os.replace(weights_path + ".tmp", weights_path)
+            checkpoint['weights_file'] = os.path.basename(weights_path)
+        
+        # Serialize in memory, then one write + atomic rename (no half-written .pt on interrupt)
+        buffer = io.BytesIO()
+        torch.save(checkpoint, buffer, pickle_protocol=5)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(buffer.getbuffer())
+        os.replace(tmp_path, path)
         self.log(f"Checkpoint saved: {path}")
+        
+        if weights_path is not None:
+            # last.pt now points at the new weights; drop the ones from earlier epochs
+            checkpoint_dir = os.path.dirname(weights_path)
+            for name in os.listdir(checkpoint_dir):
+                if (name.startswith("last-epoch") and name.endswith(".safetensors")
+                        and name != checkpoint['weights_file']):
+                    os.remove(os.path.join(checkpoint_dir, name))
 
     def _load_checkpoint(self, model, optimizer, scheduler, scaler, checkpoint_dir: str):
         """Load model checkpoint."""
         last_path = os.path.join(checkpoint_dir, "last.pt")
         if os.path.exists(last_path):
-            checkpoint = torch.load(last_path, map_location='cpu')
-            model.load_state_dict(checkpoint['model'])
+            # Tensors land directly on the training device (one copy instead of CPU -> GPU)
+            device = next(model.parameters()).device
+            try:
+                checkpoint = torch.load(last_path, map_location=device, weights_only=True)
+            except pickle.UnpicklingError:
+                # checkpoints from older PyTorch may pickle non-tensor scheduler state
+                self.log(f"{last_path} is not weights_only-loadable, falling back to full unpickling")
+                checkpoint = torch.load(last_path, map_location=device, weights_only=False)
+            if 'model' in checkpoint:
+                model.load_state_dict(checkpoint['model'])
+            else:
+                # the weights file written together with this last.pt
+                # (older checkpoints used a fixed last.safetensors name)
+                weights_path = os.path.join(checkpoint_dir, checkpoint.get('weights_file', "last.safetensors"))
+                if load_safetensors is None:
+                    raise RuntimeError(f"{last_path} keeps its weights in {weights_path}; install safetensors to resume")
+                model.load_state_dict(load_safetensors(weights_path, device=str(device)))
             optimizer.load_state_dict(checkpoint['optimizer'])
             scheduler.load_state_dict(checkpoint['scheduler'])
-            scaler.load_state_dict(checkpoint['scaler'])
+            if scaler is not None and checkpoint.get('scaler') is not None:
+                scaler.load_state_dict(checkpoint['scaler'])
             start_epoch = checkpoint['epoch'] + 1
             self.log(f"Resumed from checkpoint: {last_path}, epoch {start_epoch}")
             return start_epoch
@@ -203,72 +304,72 @@ class TrainingRunner:
     def _setup_metrics_logging(self, log_dir: str) -> str:
         """Setup CSV file for epoch metrics logging."""
         metrics_file = os.path.join(log_dir, "epoch_metrics.csv")
+        write_header = not os.path.exists(metrics_file)
+        
+        # One append handle for the whole run (closed at the end of run())
+        self._metrics_fh = open(metrics_file, 'a', newline='', encoding='utf-8', buffering=1 << 16)
+        self._metrics_writer = csv.writer(self._metrics_fh)
         
         # Create CSV header if file doesn't exist
-        if not os.path.exists(metrics_file):
-            with open(metrics_file, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                writer.writerow([
-                    'epoch', 'train_loss', 'train_grad_norm', 'train_triplets', 'train_time',
-                    'val_eer', 'val_auc', 'val_time', 'learning_rate', 'miner_mode',
-                    'best_eer', 'stagnation_epochs', 'total_time'
-                ])
+        if write_header:
+            self._metrics_writer.writerow([
+                'epoch', 'train_loss', 'train_grad_norm', 'train_triplets', 'train_time',
+                'val_eer', 'val_auc', 'val_time', 'learning_rate', 'miner_mode',
+                'best_eer', 'stagnation_epochs', 'total_time'
+            ])
+            self._metrics_fh.flush()
         
         self.log(f"Metrics will be logged to: {metrics_file}")
         return metrics_file
 
-    def _log_epoch_metrics(self, metrics_file: str, epoch: int, train_metrics: dict, 
+    def _log_epoch_metrics(self, epoch: int, train_metrics: dict, 
                           val_metrics: dict, learning_rate: float, miner_mode: str,
                           best_eer: float, stagnation_epochs: int, total_time: float):
         """Log epoch metrics to CSV file."""
-        with open(metrics_file, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                epoch + 1,
-                train_metrics.get('avg_loss', 0.0),
-                train_metrics.get('avg_grad_norm', 0.0),
-                train_metrics.get('avg_triplets', 0.0),
-                train_metrics.get('total_time', 0.0),
-                val_metrics.get('eer', 0.0),
-                val_metrics.get('auc', 0.0),
-                val_metrics.get('eval_time', 0.0),
-                learning_rate,
-                miner_mode,
-                best_eer,
-                stagnation_epochs,
-                total_time
-            ])
-
-    def _log_test_metrics(self, metrics_file: str, test_metrics: dict, total_time: float):
+        self._metrics_writer.writerow([
+            epoch + 1,
+            train_metrics.get('avg_loss', 0.0),
+            train_metrics.get('avg_grad_norm', 0.0),
+            train_metrics.get('avg_triplets', 0.0),
+            train_metrics.get('total_time', 0.0),
+            val_metrics.get('eer', 0.0),
+            val_metrics.get('auc', 0.0),
+            val_metrics.get('eval_time', 0.0),
+            learning_rate,
+            miner_mode,
+            best_eer,
+            stagnation_epochs,
+            total_time
+        ])
+        # one flush per epoch so the CSV can be tailed while training runs
+        self._metrics_fh.flush()
+
+    def _log_test_metrics(self, test_metrics: dict, total_time: float):
         """Log final test metrics to CSV file."""
-        with open(metrics_file, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                'FINAL_TEST',
-                0.0,  # train_loss
-                0.0,  # train_grad_norm
-                0.0,  # train_triplets
-                0.0,  # train_time
-                test_metrics.get('eer', 0.0),
-                test_metrics.get('auc', 0.0),
-                test_metrics.get('eval_time', 0.0),
-                0.0,  # learning_rate
-                'test',  # miner_mode
-                test_metrics.get('eer', 0.0),  # best_eer
-                0,  # stagnation_epochs
-                total_time
-            ])
-
-    def _create_data_splits(self, dataset: LmdbSignatureDataset):
+        self._metrics_writer.writerow([
+            'FINAL_TEST',
+            0.0,  # train_loss
+            0.0,  # train_grad_norm
+            0.0,  # train_triplets
+            0.0,  # train_time
+            test_metrics.get('eer', 0.0),
+            test_metrics.get('auc', 0.0),
+            test_metrics.get('eval_time', 0.0),
+            0.0,  # learning_rate
+            'test',  # miner_mode
+            test_metrics.get('eer', 0.0),  # best_eer
+            0,  # stagnation_epochs
+            total_time
+        ])
+        self._metrics_fh.flush()
+
+    def _create_data_splits(self, dataset: LmdbSignatureDataset, rng: np.random.Generator):
         """Create train/val/test splits based on user codes."""
-        # Get all unique user codes
-        user_codes = set()
-        for i in range(len(dataset)):
-            _, _, _, user_code = dataset[i]  # dataset has return_user_code=True
-            user_codes.add(user_code)
-        
-        user_codes = list(user_codes)
-        random.shuffle(user_codes)
+        # Get all unique user codes (label-only read, no signature decode);
+        # np.unique is sorted, so the shuffle below only depends on the seed
+        unique_codes = np.unique(dataset.user_codes())
+        rng.shuffle(unique_codes)
+        user_codes = unique_codes.tolist()
         
         # Calculate split sizes
         total_users = len(user_codes)
@@ -284,7 +385,7 @@ class TrainingRunner:
         
         return train_user_codes, val_user_codes, test_user_codes
 
-    def _create_dataset_sample(self, dataset: LmdbSignatureDataset) -> LmdbSignatureDataset:
+    def _create_dataset_sample(self, dataset: LmdbSignatureDataset, rng: np.random.Generator) -> LmdbSignatureDataset:
         """Create a sample of dataset for quick testing."""
         if self.dataset_cfg.dataset_sample_ratio is None:
             return dataset
@@ -295,17 +396,15 @@ class TrainingRunner:
         
         self.log(f"Creating dataset sample: {sample_size}/{total_samples} samples ({sample_ratio*100:.1f}%)")
         
-        # Randomly select indices
-        import random
-        random.seed(self.train_cfg.seed)
-        sample_indices = random.sample(range(total_samples), sample_size)
-        sample_indices.sort()  # Keep original order for reproducibility
+        # Randomly select indices (run-level Generator; the global `random` state is left alone)
+        sample_indices = np.sort(rng.choice(total_samples, size=sample_size, replace=False)).tolist()  # Keep original order
         
         # Create wrapper for sampled dataset
         class DatasetSampleWrapper:
             def __init__(self, dataset, sample_indices):
                 self.dataset = dataset
                 self.sample_indices = sample_indices
+                self._user_codes = None
 
             def __len__(self):
                 return len(self.sample_indices)
@@ -314,6 +413,11 @@ class TrainingRunner:
                 original_idx = self.sample_indices[idx]
                 return self.dataset[original_idx]
 
+            def user_codes(self):
+                if self._user_codes is None:
+                    self._user_codes = self.dataset.user_codes()[self.sample_indices]
+                return self._user_codes
+
             def collate_fn(self, batch):
                 return self.dataset.collate_fn(batch)
 
@@ -323,21 +427,21 @@ class TrainingRunner:
 
     def _create_split_dataset(self, dataset: LmdbSignatureDataset, user_codes: set, return_user_code: bool = False):
         """Create a subset of dataset for specific users."""
-        indices = []
         total_samples = len(dataset)
         
         self.log(f"Scanning {total_samples} samples for user codes...")
         
-        for i in range(total_samples):
-            # dataset всегда имеет return_user_code=True, поэтому всегда возвращает 4 значения
-            _, _, _, user_code = dataset[i]
-            if user_code in user_codes:
-                indices.append(i)
-            
-            # Show progress every 1000 samples
-            if (i + 1) % 1000 == 0 or (i + 1) == total_samples:
-                progress = (i + 1) / total_samples * 100
-                self.log(f"Progress: {i + 1}/{total_samples} ({progress:.1f}%) - Found {len(indices)} matching samples")
+        # One vectorized membership pass over the cached code array
+        all_codes = dataset.user_codes()
+        target_codes = np.array(sorted(user_codes), dtype=str)
+        indices = np.flatnonzero(np.isin(all_codes, target_codes))
+        
+        # A sampled dataset is unwrapped here: composing the index arrays gives one
+        # wrapper with a single hop into the LMDB dataset per __getitem__
+        if hasattr(dataset, "sample_indices"):
+            indices = np.asarray(dataset.sample_indices)[indices]
+            dataset = dataset.dataset
+        indices = indices.tolist()
         
         self.log(f"Found {len(indices)} samples matching {len(user_codes)} users")
         
@@ -347,6 +451,7 @@ class TrainingRunner:
                 self.dataset = dataset
                 self.indices = indices
                 self.return_user_code = return_user_code
+                self._user_codes = None
 
             def __len__(self):
                 return len(self.indices)
@@ -357,6 +462,11 @@ class TrainingRunner:
                 if self.return_user_code:
                     return tensor, mask, user_id, user_code
                 return tensor, mask, user_id
+
+            def user_codes(self):
+                if self._user_codes is None:
+                    self._user_codes = self.dataset.user_codes()[self.indices]
+                return self._user_codes
             
             def collate_fn(self, batch):
                 """Custom collate function for DataLoader."""
@@ -369,7 +479,7 @@ class TrainingRunner:
                 # Stack tensors (all have same size now)
                 x_batch = torch.stack(tensors, dim=0)  # (B, T_max, F)
                 mask = torch.stack(masks, dim=0)       # (B, T_max)
-                labels = torch.tensor(user_ids, dtype=torch.long)  # (B,)
+                labels = torch.from_numpy(np.fromiter(user_ids, dtype=np.int64, count=len(user_ids)))  # (B,)
                 
                 return x_batch, labels, mask
         
@@ -377,10 +487,53 @@ class TrainingRunner:
         wrapper.collate_fn = wrapper.collate_fn  # Добавляем collate_fn как атрибут
         return wrapper
 
+    def _prepare_data(self, rng: np.random.Generator):
+        """
+        One-time dataset setup, kept out of run(): load LMDB, sample, split by user
+        and collect the train labels for the PK sampler.
+        Returns (train_dataset, val_dataset, test_dataset, train_user_codes).
+        """
+        # Create full dataset
+        self.log("Loading dataset...")
+        full_dataset = LmdbSignatureDataset(
+            lmdb_path=self.dataset_cfg.lmdb_path,
+            max_sequence_length=self.dataset_cfg.max_sequence_length,
+            feature_pipeline=self.dataset_cfg.feature_pipeline,
+            return_user_code=True
+        )
+        # Build the user_code / user_id tables once here, so DataLoader workers inherit them
+        full_dataset.user_ids()
+        self.log(f"Full dataset loaded: {len(full_dataset)} samples")
+        
+        # Create dataset sample if specified
+        full_dataset = self._create_dataset_sample(full_dataset, rng)
+        self.log(f"Using dataset: {len(full_dataset)} samples")
+        
+        # Create data splits
+        self.log("Creating data splits...")
+        train_user_codes, val_user_codes, test_user_codes = self._create_data_splits(full_dataset, rng)
+        
+        # Create split datasets
+        self.log("Creating split datasets...")
+        train_dataset = self._create_split_dataset(full_dataset, set(train_user_codes), return_user_code=True)
+        val_dataset = self._create_split_dataset(full_dataset, set(val_user_codes))
+        test_dataset = self._create_split_dataset(full_dataset, set(test_user_codes))
+        
+        self.log(f"Dataset sizes: Train={len(train_dataset)}, Val={len(val_dataset)}, Test={len(test_dataset)}")
+        
+        # Train labels for the PK sampler: the split's slice of the cached code array
+        # (no second pass over the data); plain str list for the sampler's dict buckets
+        train_user_codes = train_dataset.user_codes().tolist()
+        
+        self.log(f"Extracted {len(train_user_codes)} user codes for PK sampling")
+        
+        return train_dataset, val_dataset, test_dataset, train_user_codes
+
     def run(self) -> None:
         """Main training run method."""
         print("Starting training run...")
         set_seed(self.train_cfg.seed)
+        configure_backends()
         device = resolve_device(self.train_cfg.device)
 
         # Setup output directories
@@ -390,7 +543,10 @@ class TrainingRunner:
         self._setup_logging(log_dir)
         
         # Setup metrics logging
-        metrics_file = self._setup_metrics_logging(log_dir)
+        self._setup_metrics_logging(log_dir)
+        
+        # Single worker keeps checkpoint writes in submission order
+        self._save_pool = ThreadPoolExecutor(max_workers=1)
         
         self.log(f"Starting training run: {run_name}")
         self.log(f"Device: {device}")
@@ -410,17 +566,11 @@ class TrainingRunner:
         self.log("FULL CONFIGURATION DUMP")
         self.log("=" * 80)
         
-        self.log("DatasetConfig:")
-        for key, value in self.dataset_cfg.__dict__.items():
-            self.log(f"  {key}: {value}")
-        
-        self.log("ModelConfig:")
-        for key, value in self.model_cfg.__dict__.items():
-            self.log(f"  {key}: {value}")
-        
-        self.log("TrainingConfig:")
-        for key, value in self.train_cfg.__dict__.items():
-            self.log(f"  {key}: {value}")
+        # One log call per dataclass instead of one per field
+        for name, cfg in (("DatasetConfig", self.dataset_cfg),
+                          ("ModelConfig", self.model_cfg),
+                          ("TrainingConfig", self.train_cfg)):
+            self.log(f"{name}:\n" + "\n".join(f"  {key}: {value}" for key, value in cfg.__dict__.items()))
         
         self.log("=" * 80)
         
@@ -440,64 +590,51 @@ class TrainingRunner:
             model = self._create_model(in_features).to(device)
             self.log(f"Model created: {sum(p.numel() for p in model.parameters())} parameters")
             
-            # Create full dataset
-            self.log("Loading dataset...")
-            full_dataset = LmdbSignatureDataset(
-                lmdb_path=self.dataset_cfg.lmdb_path,
-                max_sequence_length=self.dataset_cfg.max_sequence_length,
-                feature_pipeline=self.dataset_cfg.feature_pipeline,
-                return_user_code=True
-            )
-            self.log(f"Full dataset loaded: {len(full_dataset)} samples")
-            
-            # Create dataset sample if specified
-            full_dataset = self._create_dataset_sample(full_dataset)
-            self.log(f"Using dataset: {len(full_dataset)} samples")
-            
-            # Create data splits
-            self.log("Creating data splits...")
-            train_user_codes, val_user_codes, test_user_codes = self._create_data_splits(full_dataset)
-            
-            # Create split datasets
-            self.log("Creating split datasets...")
-            train_dataset = self._create_split_dataset(full_dataset, set(train_user_codes), return_user_code=True)
-            val_dataset = self._create_split_dataset(full_dataset, set(val_user_codes))
-            test_dataset = self._create_split_dataset(full_dataset, set(test_user_codes))
+            # Compiled wrapper shares parameters with `model`; checkpoints keep using the
+            # uncompiled module so state_dict keys stay free of the "_orig_mod." prefix.
+            # dynamic=True: PK batches and sequence lengths vary between steps.
+            run_model = model
+            if self.train_cfg.compile_model and hasattr(torch, 'compile') and device.type == 'cuda':
+                self.log("Compiling model with torch.compile (mode='reduce-overhead')...")
+                run_model = torch.compile(model, mode='reduce-overhead', dynamic=True)
+                if resolve_amp_dtype() == torch.float16:
+                    self.log("Warning: GPU has no bf16, compiling with fp16 autocast + GradScaler "
+                             "(scaler checks add graph breaks; set compile_model=False if steps slow down)")
             
-            self.log(f"Dataset sizes: Train={len(train_dataset)}, Val={len(val_dataset)}, Test={len(test_dataset)}")
+            # One seeded Generator drives the dataset sample and the user split
+            rng = np.random.default_rng(self.train_cfg.seed)
+            train_dataset, val_dataset, test_dataset, train_user_codes = self._prepare_data(rng)
             
             # Create PK sampler for balanced batches
             self.log("Creating PK sampler...")
-            # Get user_codes for train dataset
-            train_user_codes = []
-            train_dataset_size = len(train_dataset)
-            self.log(f"Extracting user codes from {train_dataset_size} train samples...")
-            
-            for idx in range(train_dataset_size):
-                _, _, _, user_code = train_dataset[idx]
-                train_user_codes.append(user_code)
-                
-                # Show progress
-                if (idx + 1) % 1000 == 0 or (idx + 1) == train_dataset_size:
-                    progress = (idx + 1) / train_dataset_size * 100
-                    self.log(f"PK sampler progress: {idx + 1}/{train_dataset_size} ({progress:.1f}%)")
-            
-            self.log(f"Extracted {len(train_user_codes)} user codes for PK sampling")
-            
             pk_sampler = PKSampler(
                 labels=train_user_codes,
                 P=self.train_cfg.pk_p,  # number of users per batch (из конфига)
                 K=self.train_cfg.pk_k,  # samples per user
-                shuffle_identities=True
+                shuffle_identities=True,
+                seed=self.train_cfg.seed
             )
             self.log(f"PK sampler created: P={self.train_cfg.pk_p}, K={self.train_cfg.pk_k}")
             
+            num_workers = self.dataset_cfg.num_workers
+            if num_workers is None:
+                num_workers = min(os.cpu_count() or 1, 8)
+            self.log(f"DataLoader workers: {num_workers}")
+            
+            # Keep workers (and their LMDB handles) alive across epochs and queue more batches;
+            # both options are only valid with worker processes (num_workers=0 on Colab/Windows).
+            # prefetch_factor is capped at 4: deeper queues only add host memory.
+            loader_kwargs = {}
+            if num_workers > 0:
+                loader_kwargs = dict(persistent_workers=True, prefetch_factor=4, worker_init_fn=_worker_init)
+            
             train_loader = DataLoader(
                 train_dataset,
                 batch_sampler=pk_sampler,
-                num_workers=self.dataset_cfg.num_workers,
+                num_workers=num_workers,
                 pin_memory=True,
-                collate_fn=train_dataset.collate_fn
+                collate_fn=train_dataset.collate_fn,
+                **loader_kwargs
             )
             
             # Create validation and test loaders
@@ -505,32 +642,42 @@ class TrainingRunner:
             val_loader = DataLoader(
                 val_dataset,
                 batch_size=self.dataset_cfg.batch_size,
-                num_workers=self.dataset_cfg.num_workers,
+                num_workers=num_workers,
                 pin_memory=True,
                 collate_fn=val_dataset.collate_fn,
-                shuffle=False
+                shuffle=False,
+                **loader_kwargs
             )
             
             test_loader = DataLoader(
                 test_dataset,
                 batch_size=self.dataset_cfg.batch_size,
-                num_workers=self.dataset_cfg.num_workers,
+                num_workers=num_workers,
                 pin_memory=True,
                 collate_fn=test_dataset.collate_fn,
-                shuffle=False
+                shuffle=False,
+                **loader_kwargs
             )
             
             # Create optimizer, scheduler, miner, loss
             self.log("Creating optimizer, scheduler, miner, loss...")
             optimizer = self._create_optimizer(model)
-            scheduler = self._create_scheduler(optimizer, len(train_loader))
+            # Start from None grads (train_one_epoch also zeroes with set_to_none=True)
+            model.zero_grad(set_to_none=True)
+            steps_per_epoch = len(train_loader)
+            scheduler = self._create_scheduler(optimizer, steps_per_epoch)
             miner = self._create_miner()
             loss_fn = self._create_loss_fn()
-            scaler = GradScaler('cuda') if self.train_cfg.mixed_precision else None
+            # bf16 autocast on Ampere+ needs no loss scaling (and no per-step scaler sync);
+            # GradScaler is only kept for the fp16 fallback on older GPUs
+            amp_dtype = resolve_amp_dtype()
+            use_fp16_scaler = self.train_cfg.mixed_precision and amp_dtype == torch.float16
+            scaler = GradScaler('cuda') if use_fp16_scaler else None
             
             self.log(f"Training setup complete:")
-            self.log(f"  - Batches per epoch: {len(train_loader)}")
+            self.log(f"  - Batches per epoch: {steps_per_epoch}")
             self.log(f"  - Learning rate: {self.train_cfg.learning_rate}")
+            self.log(f"  - Autocast dtype: {amp_dtype}, GradScaler: {scaler is not None}")
             self.log(f"  - Miner mode: {miner.mode}")
             self.log(f"  - Triplet margin: {self.train_cfg.triplet_margin}")
             
@@ -548,10 +695,12 @@ class TrainingRunner:
             for epoch in range(start_epoch, self.train_cfg.epochs):
                 epoch_start_time = time.time()
                 self.log(f"\n=== Epoch {epoch+1}/{self.train_cfg.epochs} ===")
+                # Same sampler every epoch: only the identity/sample shuffle is re-rolled
+                pk_sampler.reshuffle(self.train_cfg.seed + epoch)
                 
                 # Train one epoch
                 train_metrics = train_one_epoch(
-                    model=model,
+                    model=run_model,
                     dataloader=train_loader,
                     optimizer=optimizer,
                     scheduler=scheduler,
@@ -559,6 +708,7 @@ class TrainingRunner:
                     loss_fn=loss_fn,
                     device=device,
                     scaler=scaler,
+                    amp_dtype=amp_dtype,
                     grad_accum_steps=1,
                     logger=self.logger,
                     log_frequency=self.train_cfg.log_frequency
@@ -568,7 +718,8 @@ class TrainingRunner:
                 self.log("Starting validation...")
                 val_start_time = time.time()
                 try:
-                    val_eer, val_auc = evaluate(model, val_loader, device, self.logger)
+                    val_eer, val_auc = evaluate(run_model, val_loader, device, self.logger, amp_dtype=amp_dtype,
+                                                mixed_precision=self.train_cfg.mixed_precision)
                     val_metrics = {
                         'eer': val_eer,
                         'auc': val_auc,
@@ -611,7 +762,6 @@ class TrainingRunner:
                 current_lr = optimizer.param_groups[0]['lr']
                 
                 self._log_epoch_metrics(
-                    metrics_file=metrics_file,
                     epoch=epoch,
                     train_metrics=train_metrics,
                     val_metrics=val_metrics,
@@ -637,7 +787,8 @@ class TrainingRunner:
             
             test_start_time = time.time()
             try:
-                test_eer, test_auc = evaluate(model, test_loader, device, self.logger)
+                test_eer, test_auc = evaluate(run_model, test_loader, device, self.logger, amp_dtype=amp_dtype,
+                                              mixed_precision=self.train_cfg.mixed_precision)
                 test_metrics = {
                     'eer': test_eer,
                     'auc': test_auc,
@@ -650,7 +801,7 @@ class TrainingRunner:
                 
                 # Log test metrics to CSV
                 total_time = time.time() - training_start_time
-                self._log_test_metrics(metrics_file, test_metrics, total_time)
+                self._log_test_metrics(test_metrics, total_time)
                 
             except Exception as e:
                 self.log(f"Final test evaluation failed: {e}")
@@ -666,4 +817,11 @@ class TrainingRunner:
         except Exception as e:
             self.log(f"Training failed: {e}")
             self.log_file(f"Training failed: {e}")
-            raise e
\ No newline at end of file
+            raise e
+        finally:
+            # Wait for pending checkpoint writes before returning
+            self._save_pool.shutdown(wait=True)
+            self._metrics_fh.close()
+            # Write out whatever the buffered file handler still holds (Colab keeps the process alive)
+            for handler in logging.getLogger().handlers:
+                handler.flush()
\ No newline at end of file
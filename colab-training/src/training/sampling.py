@@ -1,7 +1,7 @@
 from __future__ import annotations
 
-from typing import Dict, List, Iterable
-import random
+from typing import List, Iterable, Optional
+import numpy as np
 from torch.utils.data import Sampler
 
 
@@ -11,41 +11,49 @@ class PKSampler(Sampler[int]):
     Requires the dataset to provide a `user_code` per index via a parallel list.
     """
 
-    def __init__(self, labels: List[str], P: int, K: int, shuffle_identities: bool = True) -> None:
+    def __init__(self, labels: List[str], P: int, K: int, shuffle_identities: bool = True,
+                 seed: Optional[int] = None) -> None:
         super().__init__(None)
         self.labels = labels
         self.P = P
         self.K = K
         self.shuffle_identities = shuffle_identities
 
-        # map label -> indices
-        self.label_to_indices: Dict[str, List[int]] = {}
-        for idx, lab in enumerate(labels):
-            self.label_to_indices.setdefault(lab, []).append(idx)
+        # SoA layout: identity j owns all_indices[offsets[j]:offsets[j + 1]].
+        # Identities get fixed int ids (sorted labels); no string hashing per batch.
+        identities, identity_ids = np.unique(np.asarray(labels, dtype=str), return_inverse=True)
+        self.identities: List[str] = identities.tolist()
+        self.all_indices = np.argsort(identity_ids, kind="stable").astype(np.int64)
+        counts = np.bincount(identity_ids, minlength=len(self.identities))
+        self.offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
 
-        # only identities with enough samples (or repeat if fewer)
-        self.identities: List[str] = list(self.label_to_indices.keys())
+        # per-sampler Generator (fresh OS entropy when no seed is given)
+        self._rng = np.random.default_rng(seed)
+
+    def reshuffle(self, seed: int) -> None:
+        """Reseed the per-epoch shuffle; label buckets are built once in __init__ and kept."""
+        self._rng = np.random.default_rng(seed)
 
     def __iter__(self) -> Iterable[List[int]]:
-        ids = self.identities[:]
-        if self.shuffle_identities:
-            random.shuffle(ids)
+        num_ids = len(self.identities)
+        ids = self._rng.permutation(num_ids) if self.shuffle_identities else np.arange(num_ids)
         
-        for i in range(0, len(ids), self.P):
+        for i in range(0, num_ids, self.P):
             group = ids[i:i + self.P]
-            batch: List[int] = []
-            for g in group:
-                pool = self.label_to_indices[g]
-                if len(pool) >= self.K:
-                    picks = random.sample(pool, self.K)
-                else:
-                    # repeat to fill
-                    mult = (self.K + len(pool) - 1) // len(pool)
-                    expanded = (pool * mult)[:self.K]
-                    random.shuffle(expanded)
-                    picks = expanded
-                batch.extend(picks)
-            yield batch
+            # K picks per identity from a view of its slice. Order inside a batch does
+            # not matter for the PK losses, so no shuffle.
+            batch = np.concatenate([
+                self._pick(self.all_indices[start:stop])
+                for start, stop in zip(self.offsets[group], self.offsets[group + 1])
+            ])
+            yield batch.tolist()
+
+    def _pick(self, pool: np.ndarray) -> np.ndarray:
+        """K indices from one identity's pool; pools smaller than K use every sample before repeating."""
+        if len(pool) >= self.K:
+            return self._rng.choice(pool, size=self.K, replace=False)
+        # tile a permutation of the pool up to K, then shuffle so repeats are not always first
+        return self._rng.permutation(np.resize(self._rng.permutation(pool), self.K))
 
     def __len__(self) -> int:
         # number of PK groups (i.e. number of batches)
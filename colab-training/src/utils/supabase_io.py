@@ -1,6 +1,7 @@
+import asyncio
 import os
-from typing import Iterable, Iterator, Optional
-from supabase import create_client, Client
+from typing import AsyncIterator, Iterable, Iterator, Optional
+from supabase import create_client, Client, acreate_client, AsyncClient
 
 
 def create_client_with_login(url: str, anon_key: str, email: str, password: str) -> Client:
@@ -9,24 +10,93 @@ def create_client_with_login(url: str, anon_key: str, email: str, password: str)
     return client
 
 
-def fetch_all(client: Client, table: str, select: str, filters: list[tuple], page_size: int = 1000) -> Iterator[dict]:
-    start = 0
+async def create_async_client_with_login(url: str, anon_key: str, email: str, password: str) -> AsyncClient:
+    client = await acreate_client(url, anon_key)
+    await client.auth.sign_in_with_password({"email": email, "password": password})
+    return client
+
+
+def _page_query(client, table: str, select: str, filters: list[tuple], page_size: int,
+                cursor_field: str, last: Optional[str]):
+    """One keyset page: rows ordered by `cursor_field`, strictly after `last`."""
+    query = client.table(table).select(select)
+    for f in filters:
+        col, op, val = f
+        if op == "eq":
+            query = query.eq(col, val)
+        else:
+            raise ValueError(f"Unsupported filter op: {op}")
+    if last is not None:
+        query = query.gt(cursor_field, last)
+    return query.order(cursor_field).limit(page_size)
+
+
+def fetch_all(
+    client: Client,
+    table: str,
+    select: str,
+    filters: list[tuple],
+    page_size: int = 1000,
+    cursor_field: str = "id",
+    cursor: Optional[str] = None,
+) -> Iterator[dict]:
+    """
+    Stream all matching rows with keyset pagination: pages are ordered by
+    `cursor_field` and each one resumes after the last seen value, so every page is
+    an index seek instead of an OFFSET scan over all preceding rows.
+    `cursor_field` must be unique, indexed and part of `select`; `cursor` resumes
+    after a known value.
+    """
+    last = cursor
     while True:
-        query = client.table(table).select(select).range(start, start + page_size - 1)
-        for f in filters:
-            col, op, val = f
-            if op == "eq":
-                query = query.eq(col, val)
-            else:
-                raise ValueError(f"Unsupported filter op: {op}")
-        rows = query.execute().data or []
+        rows = _page_query(client, table, select, filters, page_size, cursor_field, last).execute().data or []
         if not rows:
             break
         for row in rows:
             yield row
         if len(rows) < page_size:
             break
-        start += page_size
+        last = rows[-1][cursor_field]
+
 
+async def fetch_all_async(
+    client: AsyncClient,
+    table: str,
+    select: str,
+    filters: list[tuple],
+    page_size: int = 1000,
+    cursor_field: str = "id",
+    cursor: Optional[str] = None,
+) -> AsyncIterator[dict]:
+    """
+    Async version of fetch_all. A background task fetches page N+1 while the
+    caller consumes page N (one-slot queue), so DB round-trips overlap with the
+    consumer's work instead of adding up serially.
+    """
+    pages: asyncio.Queue = asyncio.Queue(maxsize=1)
 
+    async def fetch_pages() -> None:
+        last = cursor
+        try:
+            while True:
+                response = await _page_query(client, table, select, filters, page_size, cursor_field, last).execute()
+                rows = response.data or []
+                await pages.put(rows)
+                if len(rows) < page_size:
+                    break
+                last = rows[-1][cursor_field]
+        except Exception as e:  # surfaced to the consumer
+            await pages.put(e)
 
+    fetcher = asyncio.create_task(fetch_pages())
+    try:
+        while True:
+            rows = await pages.get()
+            if isinstance(rows, Exception):
+                raise rows
+            for row in rows:
+                yield row
+            if len(rows) < page_size:
+                break
+    finally:
+        fetcher.cancel()
@@ -3,13 +3,28 @@
 Содержит функции для внедрения зависимостей, которые используются в роутах
 """
 
-from typing import Optional
+import asyncio
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Optional, Tuple, Union
+import numpy as np
+import torch
 from utils.supabase_client import SupabaseClient
 from utils.model_loader import ModelLoader
 
 # Глобальные переменные для хранения инициализированных компонентов
 supabase_client: Optional[SupabaseClient] = None
 model_loader: Optional[ModelLoader] = None
+inference_batcher: Optional["InferenceBatcher"] = None
+
+# Пул входных CPU тензоров для инференса по точной форме (B, T, F): свободные буферы
+# переиспользуются между запросами. Паддинга нет - BiGRU и свертки модели не маскируются,
+# поэтому дополнение нулями изменило бы эмбеддинг. Длины подписей различны, поэтому
+# пул ограничен по числу буферов и вытесняет давно не использованные формы (LRU)
+TENSOR_POOL_MAX_BUFFERS = 64
+_tensor_pool: "OrderedDict[Tuple[int, ...], List[torch.Tensor]]" = OrderedDict()
+_tensor_pool_size = 0
+_tensor_pool_lock = threading.Lock()
 
 
 def set_supabase_client(client: SupabaseClient):
@@ -24,6 +39,12 @@ def set_model_loader(loader: ModelLoader):
     model_loader = loader
 
 
+def set_inference_batcher(batcher: "InferenceBatcher"):
+    """Установка микробатчера инференса"""
+    global inference_batcher
+    inference_batcher = batcher
+
+
 def get_supabase_client() -> SupabaseClient:
     """Получение Supabase клиента"""
     if supabase_client is None:
@@ -36,3 +57,160 @@ def get_model_loader() -> ModelLoader:
     if model_loader is None:
         raise RuntimeError("Model loader not initialized")
     return model_loader
+
+
+def get_inference_batcher() -> "InferenceBatcher":
+    """Получение микробатчера инференса"""
+    if inference_batcher is None:
+        raise RuntimeError("Inference batcher not initialized")
+    return inference_batcher
+
+
+def acquire_tensor(shape: Tuple[int, ...]) -> torch.Tensor:
+    """Взять float32 буфер формы shape из пула (содержимое не инициализировано)"""
+    global _tensor_pool_size
+    shape = tuple(shape)
+    with _tensor_pool_lock:
+        free = _tensor_pool.get(shape)
+        if free:
+            _tensor_pool_size -= 1
+            tensor = free.pop()
+            if free:
+                _tensor_pool.move_to_end(shape)
+            else:
+                del _tensor_pool[shape]
+            return tensor
+    return torch.empty(shape, dtype=torch.float32)
+
+
+def release_tensor(tensor: torch.Tensor) -> None:
+    """Вернуть буфер в пул; при переполнении вытесняются буферы давно не использованных форм"""
+    global _tensor_pool_size
+    shape = tuple(tensor.shape)
+    with _tensor_pool_lock:
+        _tensor_pool.setdefault(shape, []).append(tensor)
+        _tensor_pool.move_to_end(shape)
+        _tensor_pool_size += 1
+        while _tensor_pool_size > TENSOR_POOL_MAX_BUFFERS:
+            oldest_shape, oldest = next(iter(_tensor_pool.items()))
+            oldest.pop()
+            _tensor_pool_size -= 1
+            if not oldest:
+                del _tensor_pool[oldest_shape]
+
+
+def fill_batch(buf: torch.Tensor, *features: np.ndarray) -> torch.Tensor:
+    """
+    Копирует признаки (T, F) в строки буфера из пула (B, T, F).
+    Все строки должны иметь ровно длину T: без паддинга эмбеддинг совпадает
+    с кодированием подписи по отдельности.
+    """
+    for row, feats in enumerate(features):
+        if feats.shape[0] != buf.shape[1]:
+            raise ValueError(f"Row {row} has length {feats.shape[0]}, batch length is {buf.shape[1]}")
+        buf[row].copy_(torch.from_numpy(feats))
+    return buf
+
+
+class InferenceBatcher:
+    """
+    Динамический микробатчинг инференса: запросы кладут признаки подписи в очередь,
+    единственный воркер собирает до max_batch элементов (или ждет не дольше max_wait
+    секунд после первого), кодирует подписи одинаковой длины одним forward
+    и раздает эмбеддинги через futures.
+    """
+
+    def __init__(self, loader: ModelLoader, max_batch: int = 8, max_wait: float = 5e-3):
+        self.loader = loader
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Запуск воркера (внутри работающего event loop, из lifespan)"""
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Остановка воркера"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def submit(self, features: np.ndarray) -> torch.Tensor:
+        """Поставить подпись (T, F) в очередь и дождаться ее эмбеддинга (emb_dim,)"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((features, future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(items) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                # forward в отдельном потоке, чтобы не блокировать event loop
+                results = await asyncio.to_thread(self._encode, [f for f, _ in items])
+            except Exception as e:
+                results = [e] * len(items)
+
+            for result, (_, future) in zip(results, items):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def _encode(self, features: List[np.ndarray]) -> List[Union[torch.Tensor, Exception]]:
+        """
+        Эмбеддинг (или исключение) для каждой подписи. Подписи одинаковой длины идут
+        одним forward по (B, T, F); разные длины не смешиваются и не паддятся, поэтому
+        эмбеддинг не зависит от соседей по батчу. Если forward группы упал (например,
+        NaN/Inf в одной подписи), группа перекодируется по одной подписи, и ошибку
+        получает только запрос с плохими данными.
+        """
+        rows_by_length: Dict[int, List[int]] = defaultdict(list)
+        for row, feats in enumerate(features):
+            rows_by_length[feats.shape[0]].append(row)
+
+        results: List[Union[torch.Tensor, Exception, None]] = [None] * len(features)
+        for rows in rows_by_length.values():
+            try:
+                group_embeddings = self._encode_group([features[row] for row in rows])
+            except Exception as e:
+                if len(rows) == 1:
+                    results[rows[0]] = e
+                    continue
+                for row in rows:
+                    try:
+                        results[row] = self._encode_group([features[row]])[0]
+                    except Exception as row_error:
+                        results[row] = row_error
+                continue
+            for row, embedding in zip(rows, group_embeddings):
+                results[row] = embedding
+        return results
+
+    def _encode_group(self, group: List[np.ndarray]) -> torch.Tensor:
+        """Один forward по подписям одинаковой длины через буфер из пула"""
+        with torch.inference_mode():
+            buf = acquire_tensor((len(group),) + group[0].shape)
+            try:
+                return self.loader.encode_signature(fill_batch(buf, *group))
+            finally:
+                release_tensor(buf)
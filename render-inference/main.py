@@ -4,6 +4,7 @@ FastAPI Inference Server для анализа подписей
 
 import os
 import logging
+import httpx
 from contextlib import asynccontextmanager
 from typing import Dict, Any, List, Optional
 
@@ -13,10 +14,11 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from fastapi import FastAPI, Depends
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from utils.supabase_client import SupabaseClient
 from utils.model_loader import ModelLoader
-from dependencies import set_supabase_client, set_model_loader
+from dependencies import set_supabase_client, set_model_loader, set_inference_batcher, InferenceBatcher
 from routes.health import router as health_router
 from routes.forgery_by_id import router as forgery_by_id_router
 from routes.forgery_by_data import router as forgery_by_data_router
@@ -27,9 +29,7 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Глобальные переменные для хранения инициализированных компонентов
-supabase_client: SupabaseClient = None
-model_loader: ModelLoader = None
+# Инициализированные компоненты хранятся только в dependencies.py
 
 
 def check_environment_variables() -> Dict[str, str]:
@@ -51,10 +51,10 @@ def check_environment_variables() -> Dict[str, str]:
     return required_vars
 
 
-def initialize_supabase_client() -> SupabaseClient:
+def initialize_supabase_client(http_client: httpx.Client) -> SupabaseClient:
     """Инициализация Supabase клиента и проверка подключения"""
     try:
-        client = SupabaseClient()
+        client = SupabaseClient(http_client=http_client)
 
         # Проверка подключения через простой запрос
         # Можно использовать любой простой запрос для проверки
@@ -81,22 +81,32 @@ def initialize_model() -> ModelLoader:
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Управление жизненным циклом приложения"""
-    global supabase_client, model_loader
-
     logger.info("Starting inference server...")
 
     try:
         # Проверка переменных окружения
         env_vars = check_environment_variables()
 
+        # Один HTTP клиент на весь жизненный цикл: TCP+TLS соединения к Supabase
+        # переиспользуются между запросами (keep-alive, HTTP/2)
+        http_client = httpx.Client(
+            http2=True,
+            timeout=10.0,
+            limits=httpx.Limits(max_keepalive_connections=32),
+        )
+
         # Инициализация Supabase клиента
-        supabase_client = initialize_supabase_client()
-        set_supabase_client(supabase_client)
+        set_supabase_client(initialize_supabase_client(http_client))
 
         # Инициализация модели
         model_loader = initialize_model()
         set_model_loader(model_loader)
 
+        # Микробатчер: конкурентные запросы кодируются одним forward
+        inference_batcher = InferenceBatcher(model_loader)
+        inference_batcher.start()
+        set_inference_batcher(inference_batcher)
+
         logger.info("Inference server started successfully")
 
     except Exception as e:
@@ -107,6 +117,8 @@ async def lifespan(app: FastAPI):
 
     # Cleanup при завершении работы
     logger.info("Shutting down inference server...")
+    await inference_batcher.stop()
+    http_client.close()
 
 
 # Функции-зависимости теперь находятся в dependencies.py
@@ -117,22 +129,21 @@ app = FastAPI(
     description="FastAPI сервер для анализа подписей с использованием ML модели",
     version="1.0.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 # Настройка CORS
-frontend_urls = os.getenv("FRONTEND_URL", "http://localhost:3000").split(",")
 # Убираем пробелы и пустые строки
-frontend_urls = [url.strip() for url in frontend_urls if url.strip()]
+frontend_urls = [url.strip() for url in os.getenv("FRONTEND_URL", "http://localhost:3000").split(",")]
 
-# Добавляем дополнительные домены для разработки и продакшена
-additional_origins = [
+# Объединяем все разрешенные домены (с дополнительными для разработки и продакшена)
+# в неизменяемый кортеж со стабильным порядком; вычисляется один раз при импорте
+all_origins = tuple(sorted({
+    *(url for url in frontend_urls if url),
     "http://localhost:3000",  # Next.js dev server
     "http://127.0.0.1:3000",   # Alternative localhost
     "https://localhost:3000", # HTTPS localhost
-]
-
-# Объединяем все разрешенные домены
-all_origins = list(set(frontend_urls + additional_origins))
+}))
 
 logger.info(f"CORS allowed origins: {all_origins}")
 
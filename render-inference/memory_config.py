@@ -37,6 +37,11 @@ class MemoryConfig:
                     setattr(torch.backends.cudnn, setting.split('.')[-1], value)
             except Exception as e:
                 print(f"Warning: Could not set {setting}: {e}")
+
+        # Число потоков intra-op параллелизма (один раз при старте), например по числу vCPU инстанса
+        num_threads = os.getenv("TORCH_NUM_THREADS")
+        if num_threads:
+            torch.set_num_threads(int(num_threads))
     
     @classmethod
     def get_model_loading_kwargs(cls):
@@ -2,6 +2,7 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.nn.utils.fusion import fuse_conv_bn_eval
 
 class AttentionPool(nn.Module):
     """Temporal attention pooling for variable-length sequences.
@@ -33,8 +34,11 @@ class SignatureEncoder(nn.Module):
                  gru_hidden: int = 256,
                  gru_layers: int = 2,
                  emb_dim: int = 128,
-                 dropout: float = 0.3):
+                 dropout: float = 0.3,
+                 debug_check_finite: bool = False):
         super().__init__()
+        # NaN/Inf scan of every embedding batch; debug only (costs a reduction + host sync)
+        self.debug_check_finite = debug_check_finite
         # conv stack: input shape (B, F, T)
         self.conv1 = nn.Sequential(
             nn.Conv1d(in_features, conv_channels[0], kernel_size=5, padding=2),
@@ -75,6 +79,7 @@ class SignatureEncoder(nn.Module):
         x: (B, T, F)
         mask: (B, T) boolean mask where True denotes valid token
         returns: (B, emb_dim) L2-normalized embeddings
+                 (unit norm, so callers take cosine similarity as a plain dot product)
         """
         # Permute for Conv1d: (B, F, T)
         x = x.permute(0, 2, 1)
@@ -92,20 +97,36 @@ class SignatureEncoder(nn.Module):
             mask = mask.squeeze(1).bool()  # (B, T')
 
         # RNN
-        # flatten_parameters for speed/compatibility
-        self.bigru.flatten_parameters()
+        # flatten_parameters for speed/compatibility (dynamically quantized GRU has no such method)
+        if isinstance(self.bigru, nn.GRU):
+            self.bigru.flatten_parameters()
         out, _ = self.bigru(x)  # (B, T', 2*gru_hidden)
 
         pooled, attn_weights = self.attn(out, mask=mask)  # (B, 2*gru_hidden)
         emb = self.fc(pooled)  # (B, emb_dim)
         
-        # Check for NaN/Inf - should not happen with proper feature preprocessing
-        if torch.isnan(emb).any() or torch.isinf(emb).any():
+        # Check for NaN/Inf - should not happen with proper feature preprocessing.
+        # Off by default: NaN propagates through F.normalize and the caller checks once.
+        if self.debug_check_finite and not torch.isfinite(emb).all():
             raise RuntimeError("NaN/Inf detected in embeddings. This indicates a problem in feature preprocessing.")
         
         emb = F.normalize(emb, p=2, dim=-1)  # L2 normalize
         return emb
 
+    def fuse_bn(self) -> None:
+        """
+        Fold each BatchNorm1d into the preceding Conv1d (eval only, call once after loading):
+        w' = w * gamma / sqrt(var + eps), b' = (b - mean) * gamma / sqrt(var + eps) + beta.
+        The BN layer is replaced with nn.Identity, so forward runs one kernel less per block.
+        """
+        if self.training:
+            raise RuntimeError("fuse_bn() requires eval mode (BN must use running statistics)")
+        for block in (self.conv1, self.conv2):
+            conv, bn = block[0], block[1]
+            if isinstance(bn, nn.BatchNorm1d):
+                block[0] = fuse_conv_bn_eval(conv, bn)
+                block[1] = nn.Identity()
+
     def _init_weights(self, module):
         """Initialize weights properly to avoid NaN/Inf issues."""
         if isinstance(module, nn.Linear):
@@ -121,4 +142,4 @@ class SignatureEncoder(nn.Module):
                 if 'weight' in name:
                     nn.init.xavier_uniform_(param)
                 elif 'bias' in name:
-                    nn.init.zeros_(param)
\ No newline at end of file
+                    nn.init.zeros_(param)
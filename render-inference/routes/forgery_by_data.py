@@ -3,19 +3,23 @@
 """
 
 from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel
-from typing import Optional, List, Union
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict
+import asyncio
+from collections import OrderedDict
+from typing import Optional, List, Tuple, Union
 import logging
+import threading
+import time
+import traceback
 import torch
-import torch.nn.functional as F
 import numpy as np 
 
 # --- ИСПРАВЛЕННЫЙ ИМПОРТ ЗАВИСИМОСТЕЙ ---
 # Импортируем функции зависимостей из dependencies.py
 # Это устраняет проблему циклического импорта
-from dependencies import get_supabase_client, get_model_loader
+from dependencies import get_supabase_client, get_inference_batcher, InferenceBatcher
 from utils.supabase_client import SupabaseClient
-from utils.model_loader import ModelLoader
 from utils.preprocessing import v1_preprocess_signature_data, parse_csv_signature_data
 
 
@@ -23,6 +27,17 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/forgery-by-data", tags=["forgery-analysis"])
 
+# Порог сходства: ниже - подделка
+THRESHOLD = 0.75
+
+# LRU кэш эмбеддингов оригинальных подписей (original_id -> (время записи, эмбеддинг)):
+# повторный запрос к той же оригинальной подписи не ходит в Supabase и не гоняет
+# её через энкодер. Записи живут EMBEDDING_CACHE_TTL секунд
+EMBEDDING_CACHE_MAXSIZE = 10_000
+EMBEDDING_CACHE_TTL = 3600.0
+_embedding_cache: "OrderedDict[str, Tuple[float, torch.Tensor]]" = OrderedDict()
+_embedding_cache_lock = threading.Lock()
+
 class ForgeryByDataRequest(BaseModel):
     """Схема запроса для анализа подделки по данным."""
     original_id: str
@@ -30,16 +45,39 @@ class ForgeryByDataRequest(BaseModel):
 
 class ForgeryAnalysisResponse(BaseModel):
     """Ответ с результатом анализа подделки"""
+    model_config = ConfigDict(frozen=True)
+
     is_forgery: bool
     similarity_score: float
     threshold: float
     error: Optional[str] = None
 
+def _get_cached_embedding(original_id: str) -> Optional[torch.Tensor]:
+    """Эмбеддинг оригинальной подписи из кэша или None (нет записи / истек TTL)"""
+    with _embedding_cache_lock:
+        entry = _embedding_cache.get(original_id)
+        if entry is None:
+            return None
+        stored_at, embedding = entry
+        if time.monotonic() - stored_at > EMBEDDING_CACHE_TTL:
+            del _embedding_cache[original_id]
+            return None
+        _embedding_cache.move_to_end(original_id)
+        return embedding
+
+def _cache_embedding(original_id: str, embedding: torch.Tensor) -> None:
+    """Сохранить эмбеддинг оригинальной подписи, вытесняя самую давнюю запись"""
+    with _embedding_cache_lock:
+        _embedding_cache[original_id] = (time.monotonic(), embedding)
+        _embedding_cache.move_to_end(original_id)
+        if len(_embedding_cache) > EMBEDDING_CACHE_MAXSIZE:
+            _embedding_cache.popitem(last=False)
+
 @router.post("/", response_model=ForgeryAnalysisResponse)
 async def analyze_forgery_by_data(
     request_body: ForgeryByDataRequest, 
     supabase_client: SupabaseClient = Depends(get_supabase_client),
-    model_loader: ModelLoader = Depends(get_model_loader)
+    batcher: InferenceBatcher = Depends(get_inference_batcher)
 ):
     """
     Анализ подделки по ID оригинальной подписи и данным поддельной подписи
@@ -47,7 +85,7 @@ async def analyze_forgery_by_data(
     Args:
         request_body: Валидированное тело запроса
         supabase_client: Клиент Supabase
-        model_loader: Загрузчик модели
+        batcher: Микробатчер инференса
     
     Returns:
         Результат анализа подделки
@@ -56,60 +94,71 @@ async def analyze_forgery_by_data(
     original_id = request_body.original_id
 
     try:
-        logger.info("=== FORGERY BY DATA REQUEST START ===")
-        logger.info(f"Analyzing forgery by data: original={original_id}")
-        logger.info(f"Forgery data type: {type(request_body.forgery_data)}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Analyzing forgery by data: original=%s, forgery data type: %s",
+                         original_id, type(request_body.forgery_data).__name__)
+
+        # Блокирующие вызовы (HTTP к Supabase, разбор CSV, препроцессинг) идут в пул
+        # потоков через asyncio.to_thread: event loop (и воркер микробатчера) не стоит
 
-        # --- Шаг 1: Получение данных оригинальной подписи ---
-        original_data = supabase_client.get_signature_data(original_id, "genuine")
-        if not original_data:
-            raise HTTPException(status_code=404, detail=f"Original signature {original_id} not found in genuine signatures")
+        # --- Шаг 1: Эмбеддинг оригинальной подписи из кэша, иначе данные из Supabase ---
+        original_embedding = _get_cached_embedding(original_id)
+        if original_embedding is None:
+            original_data = await asyncio.to_thread(supabase_client.get_signature_data, original_id, "genuine")
+            if not original_data:
+                raise HTTPException(status_code=404, detail=f"Original signature {original_id} not found in genuine signatures")
 
         # --- Шаг 2: Обработка данных поддельной подписи ---
         forgery_data: List[List[float]]
 
         if isinstance(request_body.forgery_data, str):
             # Если это CSV строка, парсим её
-            logger.info("Parsing CSV forgery data")
-            forgery_data = parse_csv_signature_data(request_body.forgery_data)
+            logger.debug("Parsing CSV forgery data")
+            forgery_data = await asyncio.to_thread(parse_csv_signature_data, request_body.forgery_data)
         else:
             # Если это уже список списков, используем как есть
-            logger.info("Using forgery data as list of lists")
+            logger.debug("Using forgery data as list of lists")
             forgery_data = request_body.forgery_data
 
-        if not forgery_data:
+        # len(), а не truthiness: CSV парсится в np.ndarray
+        if len(forgery_data) == 0:
             raise HTTPException(status_code=400, detail="Invalid forgery data provided or failed to parse")
 
-        # --- Шаг 3: Препроцессинг и подготовка тензоров ---
-        original_features = v1_preprocess_signature_data(original_data)
-        forgery_features = v1_preprocess_signature_data(forgery_data)
-
-        # Преобразуем в тензоры PyTorch
-        original_tensor = torch.from_numpy(original_features).float().unsqueeze(0)
-        forgery_tensor = torch.from_numpy(forgery_features).float().unsqueeze(0)
+        # --- Шаг 3: Препроцессинг ---
+        forgery_features = await asyncio.to_thread(v1_preprocess_signature_data, forgery_data)
 
         # --- Шаг 4: Получение эмбеддингов и анализ ---
-        original_embedding = model_loader.encode_signature(original_tensor)
-        forgery_embedding = model_loader.encode_signature(forgery_tensor)
-
-        # Вычисляем косинусное сходство
-        similarity_score = float(F.cosine_similarity(original_embedding, forgery_embedding, dim=1))
+        # Подписи уходят в микробатчер: подписи одинаковой длины (в т.ч. из конкурентных
+        # запросов) кодируются одним forward, разные длины не смешиваются.
+        # При попадании в кэш кодируется только поддельная подпись
+        if original_embedding is None:
+            original_features = await asyncio.to_thread(v1_preprocess_signature_data, original_data)
+            original_embedding, forgery_embedding = await asyncio.gather(
+                batcher.submit(original_features), batcher.submit(forgery_features)
+            )
+            original_embedding = original_embedding.clone()
+            _cache_embedding(original_id, original_embedding)
+        else:
+            forgery_embedding = await batcher.submit(forgery_features)
 
-        # Определяем порог для подделки
-        threshold = 0.75
+        # Вычисляем косинусное сходство: SignatureEncoder возвращает L2-нормализованные
+        # эмбеддинги, поэтому косинус равен скалярному произведению
+        with torch.inference_mode():
+            similarity_score = float(torch.dot(original_embedding, forgery_embedding))
 
         # Определяем, является ли это подделкой
-        is_forgery = similarity_score < threshold
+        is_forgery = similarity_score < THRESHOLD
 
-        logger.info(f"Analysis completed: similarity={similarity_score:.4f}, is_forgery={is_forgery}")
+        # Единственная INFO строка на запрос
+        logger.info("forgery original=%s similarity=%.4f is_forgery=%d", original_id, similarity_score, int(is_forgery))
 
-        result = ForgeryAnalysisResponse(
+        # Поля сформированы сервером: model_construct без повторной валидации,
+        # сериализация через orjson в обход response_model
+        result = ORJSONResponse(ForgeryAnalysisResponse.model_construct(
             is_forgery=is_forgery,
             similarity_score=similarity_score,
-            threshold=threshold
-        )
-
-        logger.info(f"=== FORGERY BY DATA REQUEST SUCCESS ===")
+            threshold=THRESHOLD
+        ).model_dump())
         return result
 
     except HTTPException as e:
@@ -119,13 +168,12 @@ async def analyze_forgery_by_data(
     except Exception as e:
         logger.error(f"=== FORGERY BY DATA GENERAL ERROR ===")
         logger.error(f"Error analyzing forgery by data: {str(e)}")
-        import traceback
         logger.error(f"Traceback: {traceback.format_exc()}")
 
         # Возвращаем структурированный ответ об ошибке
-        return ForgeryAnalysisResponse(
+        return ORJSONResponse(ForgeryAnalysisResponse.model_construct(
             is_forgery=False,
             similarity_score=0.0,
-            threshold=0.75,
+            threshold=THRESHOLD,
             error=f"Analysis failed: {type(e).__name__}: {str(e)}"
-        )
\ No newline at end of file
+        ).model_dump())
\ No newline at end of file
@@ -7,7 +7,6 @@ from pydantic import BaseModel
 from typing import Optional
 import logging
 import torch
-import torch.nn.functional as F
 import numpy as np 
 
 # --- Импорт локальных компонентов проекта ---
@@ -81,8 +80,9 @@ async def analyze_forgery_by_id(
         forgery_features = v1_preprocess_signature_data(forgery_data)
         logger.info(f"Preprocessing completed. Original features shape: {original_features.shape}, Forgery features shape: {forgery_features.shape}")
         
-        original_tensor = torch.from_numpy(original_features).float().unsqueeze(0)
-        forgery_tensor = torch.from_numpy(forgery_features).float().unsqueeze(0)
+        # Признаки уже contiguous float32: тензор - представление numpy буфера без копии
+        original_tensor = torch.from_numpy(original_features).unsqueeze_(0)
+        forgery_tensor = torch.from_numpy(forgery_features).unsqueeze_(0)
         logger.info(f"Tensors created. Original tensor shape: {original_tensor.shape}, Forgery tensor shape: {forgery_tensor.shape}")
 
         # --- Шаг 3: Получение эмбеддингов и анализ ---
@@ -98,7 +98,9 @@ async def analyze_forgery_by_id(
             raise HTTPException(status_code=500, detail=f"Model inference failed: {str(e)}")
 
         logger.info("Step 4: Calculating similarity")
-        similarity_score = float(F.cosine_similarity(original_embedding, forgery_embedding, dim=1))
+        # Эмбеддинги L2-нормализованы в SignatureEncoder: косинус равен скалярному произведению
+        with torch.inference_mode():
+            similarity_score = float(torch.dot(original_embedding[0], forgery_embedding[0]))
 
         threshold = 0.7 
         is_forgery = similarity_score < threshold
@@ -0,0 +1,80 @@
+"""
+Тесты разбора CSV данных подписи (np.loadtxt и построчный fallback)
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# Добавляем путь к модулям
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.preprocessing import parse_csv_signature_data, _parse_csv_rows
+
+ROWS = [[0.0, 1.0, 2.0, 3.0], [1.0, 4.0, 5.0, 6.0]]
+
+
+def test_fast_path():
+    """Корректный CSV разбирается np.loadtxt в float32 (N, 4)"""
+    data = parse_csv_signature_data("t,x,y,p\n0,1,2,3\n1,4,5,6\n")
+    assert data.dtype == np.float32
+    assert data.tolist() == ROWS
+
+
+def test_single_row_is_2d():
+    """Одна строка данных дает (1, 4), а не вектор"""
+    assert parse_csv_signature_data("t,x,y,p\n0,1,2,3").shape == (1, 4)
+
+
+def test_columns_follow_header():
+    """Порядок колонок берется из заголовка, лишние колонки игнорируются"""
+    data = parse_csv_signature_data("x,y,extra,t,p\n1,2,9,0,3\n4,5,9,1,6")
+    assert data.tolist() == ROWS
+
+
+def test_crlf():
+    """Переводы строк CRLF не ломают ни заголовок, ни данные"""
+    data = parse_csv_signature_data("t,x,y,p\r\n0,1,2,3\r\n1,4,5,6\r\n")
+    assert data.tolist() == ROWS
+
+
+def test_hash_is_not_a_comment():
+    """'#' в строке не обрезает ее: строка не теряется молча"""
+    data = parse_csv_signature_data("note,t,x,y,p\n#a,0,1,2,3\nb#c,1,4,5,6")
+    assert data.tolist() == ROWS
+
+
+def test_ragged_rows_are_skipped():
+    """Короткие строки пропускаются построчным разбором, остальные сохраняются"""
+    data = parse_csv_signature_data("t,x,y,p\n0,1,2,3\n1,4\n\n1,4,5,6")
+    assert data.tolist() == ROWS
+
+
+def test_non_numeric_rows_are_skipped():
+    """Строки с нечисловыми значениями пропускаются"""
+    data = parse_csv_signature_data("t,x,y,p\n0,1,2,3\n1,oops,5,6\n1,4,5,6")
+    assert data.tolist() == ROWS
+
+
+def test_quoted_fields():
+    """Поля в кавычках (в т.ч. с запятой внутри) разбираются как в csv.reader"""
+    data = parse_csv_signature_data('note,t,x,y,p\n"a,b","0","1","2","3"\n"c",1,4,5,6')
+    assert data.tolist() == ROWS
+
+
+def test_parse_csv_rows_empty():
+    """Fallback без валидных строк возвращает пустой (0, 4)"""
+    assert _parse_csv_rows("1,2\nfoo,bar,baz,qux\n", (0, 1, 2, 3)).shape == (0, 4)
+
+
+@pytest.mark.parametrize("csv_text, message", [
+    ("t,x,y,p\n", "at least header and one data row"),
+    ("t,x,y\n0,1,2", "Required columns not found"),
+    ("t,x,y,p\n0,1\nfoo,1,2,3", "No valid data rows"),
+])
+def test_invalid_csv(csv_text, message):
+    """Ошибки формата поднимают ValueError с понятным сообщением"""
+    with pytest.raises(ValueError, match=message):
+        parse_csv_signature_data(csv_text)
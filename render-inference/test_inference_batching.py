@@ -0,0 +1,163 @@
+"""
+Тесты пула входных тензоров и микробатчера инференса
+"""
+
+import asyncio
+import os
+import sys
+
+import numpy as np
+import pytest
+import torch
+
+# Добавляем путь к модулям
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import dependencies
+from dependencies import acquire_tensor, release_tensor, fill_batch, InferenceBatcher
+from models.v1 import SignatureEncoder
+
+N_FEATURES = 11
+
+
+class _Loader:
+    """Минимальная замена ModelLoader: encode_signature поверх модели в eval"""
+
+    def __init__(self, model):
+        self.model = model
+        self.calls = []
+
+    def encode_signature(self, signature_data, mask=None):
+        self.calls.append(tuple(signature_data.shape))
+        # как в ModelLoader: невалидный вход -> ошибка на весь forward
+        if not torch.isfinite(signature_data).all():
+            raise RuntimeError("Invalid embeddings detected (NaN/Inf)")
+        with torch.inference_mode():
+            return self.model(signature_data, mask)
+
+
+@pytest.fixture
+def model():
+    torch.manual_seed(0)
+    model = SignatureEncoder(in_features=N_FEATURES, gru_hidden=32, gru_layers=2, emb_dim=16, dropout=0.0)
+    # Ненулевая статистика BN: после свертки BN в Conv1d смещения ненулевые,
+    # и нулевой паддинг перестал бы быть нулевым уже после conv1
+    for bn in (model.conv1[1], model.conv2[1]):
+        bn.running_mean.uniform_(-0.5, 0.5)
+        bn.running_var.uniform_(0.5, 2.0)
+    model.eval()
+    model.fuse_bn()
+    return model
+
+
+def _signature(length: int, seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((length, N_FEATURES)).astype(np.float32)
+
+
+def _encode_alone(model, features: np.ndarray) -> torch.Tensor:
+    """Эталон: подпись кодируется одна, на своей точной длине"""
+    with torch.inference_mode():
+        return model(torch.from_numpy(features).unsqueeze(0))[0]
+
+
+def test_pooled_encode_matches_unpadded(model):
+    """Кодирование через пул (буфер переиспользован с мусором) совпадает с прямым forward"""
+    features = _signature(137, seed=1)
+    dirty = acquire_tensor((1, 137, N_FEATURES))
+    dirty.fill_(123.0)
+    release_tensor(dirty)
+
+    loader = _Loader(model)
+    embedding = InferenceBatcher(loader)._encode([features])[0]
+
+    assert loader.calls == [(1, 137, N_FEATURES)]  # точная длина, без паддинга
+    torch.testing.assert_close(embedding, _encode_alone(model, features))
+
+
+def test_pool_evicts_least_recently_used_shapes():
+    """Новые формы вытесняют давно не использованные, и недавняя форма берется из пула"""
+    recent = acquire_tensor((1, 33, N_FEATURES))
+    release_tensor(recent)
+    for length in range(1000, 1000 + 2 * dependencies.TENSOR_POOL_MAX_BUFFERS):
+        release_tensor(acquire_tensor((1, length, N_FEATURES)))
+        # недавно использованная форма не вытесняется потоком разных длин
+        reused = acquire_tensor((1, 33, N_FEATURES))
+        assert reused is recent
+        release_tensor(reused)
+
+    assert dependencies._tensor_pool_size == dependencies.TENSOR_POOL_MAX_BUFFERS
+    assert sum(map(len, dependencies._tensor_pool.values())) == dependencies.TENSOR_POOL_MAX_BUFFERS
+    # самые старые формы вытеснены, последняя осталась в пуле
+    assert (1, 1000, N_FEATURES) not in dependencies._tensor_pool
+    last = (1, 999 + 2 * dependencies.TENSOR_POOL_MAX_BUFFERS, N_FEATURES)
+    assert last in dependencies._tensor_pool
+
+
+def test_fill_batch_rejects_other_lengths():
+    """В буфер попадают только строки ровно его длины"""
+    buf = acquire_tensor((2, 50, N_FEATURES))
+    try:
+        with pytest.raises(ValueError):
+            fill_batch(buf, _signature(50, seed=2), _signature(49, seed=3))
+    finally:
+        release_tensor(buf)
+
+
+def test_original_embedding_independent_of_forgery_length(model):
+    """Эмбеддинг оригинала не зависит от длины подписи, с которой он попал в батч"""
+    original = _signature(120, seed=4)
+    expected = _encode_alone(model, original)
+    batcher = InferenceBatcher(_Loader(model))
+
+    for forgery_length in (120, 64, 300):
+        embeddings = batcher._encode([original, _signature(forgery_length, seed=5)])
+        torch.testing.assert_close(embeddings[0], expected)
+
+
+def test_equal_lengths_share_one_forward(model):
+    """Подписи одной длины кодируются одним forward, разные длины - отдельными"""
+    loader = _Loader(model)
+    features = [_signature(80, seed=6), _signature(96, seed=7), _signature(80, seed=8)]
+    embeddings = InferenceBatcher(loader)._encode(features)
+
+    assert sorted(loader.calls) == [(1, 96, N_FEATURES), (2, 80, N_FEATURES)]
+    for feats, embedding in zip(features, embeddings):
+        torch.testing.assert_close(embedding, _encode_alone(model, feats))
+
+
+def _submit_concurrently(batcher: InferenceBatcher, features):
+    """Конкурентная отправка подписей в запущенный микробатчер, результаты по порядку"""
+    async def run():
+        batcher.start()
+        try:
+            return await asyncio.gather(*(batcher.submit(f) for f in features), return_exceptions=True)
+        finally:
+            await batcher.stop()
+    return asyncio.run(run())
+
+
+def test_concurrent_requests_get_their_own_embeddings(model):
+    """Конкурентные запросы попадают в один микробатч, но каждый получает свой эмбеддинг"""
+    loader = _Loader(model)
+    lengths = [90, 64, 90, 120, 64, 90]
+    features = [_signature(length, seed=10 + i) for i, length in enumerate(lengths)]
+
+    results = _submit_concurrently(InferenceBatcher(loader, max_batch=8, max_wait=0.05), features)
+
+    # одна группа на каждую длину
+    assert sorted(loader.calls) == [(1, 120, N_FEATURES), (2, 64, N_FEATURES), (3, 90, N_FEATURES)]
+    for feats, embedding in zip(features, results):
+        torch.testing.assert_close(embedding, _encode_alone(model, feats))
+
+
+def test_bad_input_fails_only_its_request(model):
+    """Подпись с NaN получает ошибку, соседи той же длины в батче - свои эмбеддинги"""
+    loader = _Loader(model)
+    features = [_signature(70, seed=20), _signature(70, seed=21), _signature(70, seed=22)]
+    features[1][5, 3] = np.nan
+
+    results = _submit_concurrently(InferenceBatcher(loader, max_batch=8, max_wait=0.05), features)
+
+    assert isinstance(results[1], RuntimeError)
+    torch.testing.assert_close(results[0], _encode_alone(model, features[0]))
+    torch.testing.assert_close(results[2], _encode_alone(model, features[2]))
@@ -162,7 +162,8 @@ class ModelLoader:
                 gru_hidden=self.model_config.get('gru_hidden', 256),
                 gru_layers=self.model_config.get('gru_layers', 3),
                 emb_dim=self.model_config.get('embedding_dim', 256),
-                dropout=self.model_config.get('dropout', 0.2)
+                dropout=self.model_config.get('dropout', 0.2),
+                debug_check_finite=os.getenv("DEBUG_CHECK_FINITE", "false").lower() == "true"
             )
             
             # Загрузка весов модели
@@ -188,6 +189,18 @@ class ModelLoader:
             # Установка режима оценки
             self.model.eval()
             
+            # BatchNorm с замороженной статистикой вносится в веса Conv1d
+            self.model.fuse_bn()
+            
+            # Опционально: динамическая int8 квантизация (DYNAMIC_QUANTIZATION, только CPU)
+            self.model = self._quantize_dynamic(self.model)
+            
+            # Опционально: torch.compile (COMPILE_MODEL=true), длина подписи переменная -> dynamic=True.
+            # Первый запрос после старта платит за компиляцию
+            if os.getenv("COMPILE_MODEL", "false").lower() == "true":
+                self.model = torch.compile(self.model, dynamic=True)
+                logger.info("Model wrapped with torch.compile(dynamic=True)")
+            
             # Очистка кэша checkpoint для экономии памяти
             self.checkpoint_cache = checkpoint
             del checkpoint
@@ -202,6 +215,25 @@ class ModelLoader:
             self.is_model_loaded = False
             raise
     
+    def _quantize_dynamic(self, model: nn.Module) -> nn.Module:
+        """
+        Динамическая int8 квантизация весов (torch.ao.quantization.quantize_dynamic).
+        Режим задается переменной DYNAMIC_QUANTIZATION:
+          "off" (по умолчанию) - без квантизации, "linear" - только Linear,
+          "linear+gru" - GRU и Linear (если квантизация GRU не ухудшает сходство).
+        Квантизация с потерями: включать только после перепроверки EER и порогов
+        сходства (0.75 / 0.7) на валидации.
+        Квантованные ядра есть только для CPU, на GPU/MPS модель не меняется.
+        """
+        mode = os.getenv("DYNAMIC_QUANTIZATION", "off").lower()
+        if mode == "off" or self.device.type != "cpu":
+            return model
+        
+        modules = {nn.Linear, nn.GRU} if mode == "linear+gru" else {nn.Linear}
+        quantized = torch.ao.quantization.quantize_dynamic(model, modules, dtype=torch.qint8)
+        logger.info(f"Dynamic int8 quantization applied to: {sorted(m.__name__ for m in modules)}")
+        return quantized
+    
     def is_loaded(self) -> bool:
         """Проверка, загружена ли модель"""
         return self.is_model_loaded and self.model is not None
@@ -231,7 +263,8 @@ class ModelLoader:
             raise RuntimeError("Model is not loaded")
         
         try:
-            with torch.no_grad():
+            # inference_mode строже no_grad: без version counters и отслеживания view
+            with torch.inference_mode():
                 # Перемещение данных на нужное устройство
                 signature_data = signature_data.to(self.device)
                 if mask is not None:
@@ -240,8 +273,8 @@ class ModelLoader:
                 # Получение эмбеддингов
                 embeddings = self.model(signature_data, mask)
                 
-                # Проверка на валидность эмбеддингов
-                if torch.isnan(embeddings).any() or torch.isinf(embeddings).any():
+                # Проверка на валидность эмбеддингов (один проход isfinite вместо isnan + isinf)
+                if not torch.isfinite(embeddings).all():
                     raise RuntimeError("Invalid embeddings detected (NaN/Inf)")
                 
                 logger.debug(f"Generated embeddings shape: {embeddings.shape}")
@@ -153,7 +153,8 @@ def v1_preprocess_signature_data(
             processed_data = np.nan_to_num(processed_data, nan=0.0, posinf=0.0, neginf=0.0)
         
         logger.debug(f"Processed signature data shape: {processed_data.shape}")
-        return processed_data.astype(np.float32)
+        # contiguous float32 без лишней копии: результат отдается в torch.from_numpy как есть
+        return np.ascontiguousarray(processed_data, dtype=np.float32)
         
     except Exception as e:
         logger.error(f"Error preprocessing signature data: {e}")
@@ -187,42 +188,47 @@ def parse_csv_signature_data(csv_text: str) -> np.ndarray:
     from io import StringIO
     
     try:
-        reader = csv.reader(StringIO(csv_text.strip()))
-        rows = list(reader)
+        header_line, _, body = csv_text.strip().partition('\n')
+        header = next(csv.reader([header_line.rstrip('\r')]))
         
-        if len(rows) < 2:
+        if not body.strip():
             raise ValueError("CSV must have at least header and one data row")
         
-        header = rows[0]
-        data_rows = rows[1:]
-        
         # Поиск индексов колонок
         try:
-            t_idx = header.index('t')
-            x_idx = header.index('x')
-            y_idx = header.index('y')
-            p_idx = header.index('p')
+            columns = (header.index('t'), header.index('x'), header.index('y'), header.index('p'))
         except ValueError as e:
             raise ValueError(f"Required columns not found in CSV header: {e}")
         
-        # Извлечение данных
-        data = []
-        for row in data_rows:
-            if len(row) > max(t_idx, x_idx, y_idx, p_idx):
-                try:
-                    t_val = float(row[t_idx])
-                    x_val = float(row[x_idx])
-                    y_val = float(row[y_idx])
-                    p_val = float(row[p_idx])
-                    data.append([t_val, x_val, y_val, p_val])
-                except (ValueError, IndexError):
-                    continue
-        
-        if not data:
+        # Разбор чисел в C (np.loadtxt); некорректные строки -> построчный разбор с их пропуском
+        # (comments=None: символ '#' в строке не обрезает ее как комментарий)
+        try:
+            data = np.loadtxt(StringIO(body), delimiter=',', dtype=np.float32, usecols=columns, ndmin=2,
+                              comments=None)
+        except ValueError:
+            data = _parse_csv_rows(body, columns)
+        
+        if data.size == 0:
             raise ValueError("No valid data rows found in CSV")
         
-        return np.array(data, dtype=np.float32)
+        return data
         
     except Exception as e:
         logger.error(f"Error parsing CSV signature data: {e}")
         raise
+
+
+def _parse_csv_rows(body: str, columns: tuple) -> np.ndarray:
+    """Построчный разбор CSV (без заголовка) с пропуском некорректных строк"""
+    import csv
+    from io import StringIO
+    
+    max_idx = max(columns)
+    data = []
+    for row in csv.reader(StringIO(body)):
+        if len(row) > max_idx:
+            try:
+                data.append([float(row[idx]) for idx in columns])
+            except ValueError:
+                continue
+    return np.array(data, dtype=np.float32).reshape(-1, len(columns))
@@ -4,7 +4,8 @@
 """
 
 import os
-from supabase import create_client, Client
+import httpx
+from supabase import create_client, Client, ClientOptions
 from typing import Optional, Dict, Any, Literal
 import logging
 
@@ -14,7 +15,12 @@ logger = logging.getLogger(__name__)
 class SupabaseClient:
     """Клиент для работы с Supabase с service_role правами"""
 
-    def __init__(self):
+    def __init__(self, http_client: Optional[httpx.Client] = None):
+        """
+        Args:
+            http_client: общий httpx.Client (keep-alive пул соединений), которым владеет
+                lifespan приложения; None - клиент по умолчанию из supabase
+        """
         self.url = os.getenv("SUPABASE_URL")
         self.service_role_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 
@@ -24,7 +30,8 @@ class SupabaseClient:
                 "SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY"
             )
 
-        self.client: Client = create_client(self.url, self.service_role_key)
+        options = ClientOptions(httpx_client=http_client) if http_client is not None else None
+        self.client: Client = create_client(self.url, self.service_role_key, options=options)
         logger.info("Supabase client initialized with service_role")
 
     def get_client(self) -> Client:
@@ -43,7 +50,7 @@ class SupabaseClient:
             Список точек подписи или None если не найдена
         """
         try:
-            logger.info(f"Getting signature data for ID: {signature_id}, table_type: {table_type}")
+            logger.debug("Getting signature data for ID: %s, table_type: %s", signature_id, table_type)
             
             if table_type == "genuine":
                 return self._get_signature_from_table(signature_id, "genuine_signatures")
@@ -70,15 +77,15 @@ class SupabaseClient:
             Список точек подписи или None если не найдена
         """
         try:
-            logger.info(f"Querying {table_name} for signature {signature_id}")
+            logger.debug("Querying %s for signature %s", table_name, signature_id)
             result = self.client.table(table_name).select('features_table').eq('id', signature_id).single().execute()
             
             if result.data:
                 # Парсим CSV данные
                 csv_data = result.data['features_table']
-                logger.info(f"Found CSV data in {table_name}, length: {len(csv_data)}")
+                logger.debug("Found CSV data in %s, length: %d", table_name, len(csv_data))
                 parsed_data = self._parse_csv_signature_data(csv_data)
-                logger.info(f"Parsed data length: {len(parsed_data)}")
+                logger.debug("Parsed data length: %d", len(parsed_data))
                 return parsed_data
             else:
                 logger.warning(f"Signature {signature_id} not found in {table_name}")